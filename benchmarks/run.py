@@ -0,0 +1,419 @@
+"""
+Offline load test and benchmark for every ReviewVerse endpoint.
+
+The FastAPI app is driven in process through httpx's ASGI transport, with
+MongoDB, Redis, Cloudinary and SMTP replaced by the local stand-ins in
+benchmarks/stubs.py. Nothing leaves the machine.
+
+Usage (from the repository root):
+    pip install -r requirements.txt -r benchmarks/requirements.txt
+    python -m benchmarks.run --users 1000 --reviews 10000 --requests 200 --concurrency 20
+    python -m benchmarks.run --output baseline.json
+    python -m benchmarks.run --compare baseline.json --threshold 0.10
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+# Make sure importing the app never needs real settings
+os.environ.setdefault("REDIS_PORT", "6379")
+os.environ.setdefault("SESSION_SECRET", "benchmark-session-secret")
+
+import httpx  # type: ignore
+from bson import ObjectId
+from PIL import Image  # type: ignore
+
+from benchmarks import stubs
+
+
+@dataclass
+class Context:
+    user_ids: List[str]
+    reviews: List[tuple]
+    image: bytes
+    unique_images: bool
+    rng: random.Random
+    # Targets created per run for the destructive endpoints
+    deletable_users: List[str] = field(default_factory=list)
+    deletable_reviews: List[tuple] = field(default_factory=list)
+    # Session tokens for the first users, as /login would issue them
+    session_tokens: List[str] = field(default_factory=list)
+
+    def upload(self, name: str, i: int) -> tuple:
+        data = self.image
+        if self.unique_images:
+            # Bytes after the JPEG end marker are ignored by decoders but change the hash
+            data = data + i.to_bytes(8, "big")
+        return (name, data, "image/jpeg")
+
+
+@dataclass
+class Endpoint:
+    name: str
+    build: Callable[[Context, int], dict]
+    setup: Optional[Callable] = None
+    # Cap for endpoints that are slow by design (e.g. /health samples CPU for 1s)
+    max_requests: Optional[int] = None
+
+
+def _user(ctx: Context, i: int) -> str:
+    return ctx.user_ids[i % len(ctx.user_ids)]
+
+
+def _review(ctx: Context, i: int) -> tuple:
+    return ctx.reviews[i % len(ctx.reviews)]
+
+
+def _register(ctx: Context, i: int) -> dict:
+    return {
+        "method": "POST",
+        "url": "/register",
+        "data": {
+            "username": f"bench{i}",
+            "email": f"bench{i}-{ctx.rng.getrandbits(32)}@bench.example.com",
+            "password": stubs.BENCH_PASSWORD,
+            "gender": "other",
+            "age": "30",
+            "currentrole": "student",
+        },
+        "files": {"profilephoto": ctx.upload("profile.jpg", i)},
+    }
+
+
+def _add_review(ctx: Context, i: int) -> dict:
+    bookname, bookauthor = ctx.rng.choice(stubs.BOOKS)
+    return {
+        "method": "POST",
+        "url": "/add-review",
+        "data": {
+            "bookname": bookname,
+            "bookauthor": bookauthor,
+            "experience": "A benchmark review with a few words of experience text.",
+            "readingstatus": "finished",
+            "rating": "4.5",
+            "buyplace": "online",
+            "satisfied": "true",
+            "user_id": _user(ctx, i),
+        },
+        "files": {"bookphoto": ctx.upload("book.jpg", i)},
+    }
+
+
+def _add_review_with_session(ctx: Context, i: int) -> dict:
+    request = _add_review(ctx, i)
+    del request["data"]["user_id"]
+    request["headers"] = {"Authorization": f"Bearer {ctx.session_tokens[i % len(ctx.session_tokens)]}"}
+    return request
+
+
+def _update_review(ctx: Context, i: int) -> dict:
+    user_id, review_id = _review(ctx, i)
+    return {
+        "method": "PUT",
+        "url": f"/update-review/{user_id}/{review_id}",
+        "data": {"rating": str(ctx.rng.randint(0, 5)), "readingstatus": "continue"},
+    }
+
+
+async def _setup_delete_users(ctx: Context, app_module, n: int):
+    docs = [{"_id": ObjectId(), "username": f"gone{i}", "email": f"gone{i}@bench.example.com"} for i in range(n)]
+    await app_module.users_collection.insert_many(docs)
+    ctx.deletable_users = [str(d["_id"]) for d in docs]
+
+
+async def _setup_sessions(ctx: Context, app_module, n: int):
+    users = await app_module.users_collection.find({"_id": {"$in": [ObjectId(u) for u in ctx.user_ids[:100]]}}).to_list(length=None)
+    ctx.session_tokens = [await app_module.sessions.create_session(app_module.r, user) for user in users]
+
+
+async def _setup_delete_reviews(ctx: Context, app_module, n: int):
+    user_id = _user(ctx, 0)
+    docs = [{"_id": ObjectId(), "bookname": "Gone", "bookauthor": "Nobody", "user_id": user_id,
+             "experience": "", "readingstatus": "start", "rating": 1.0, "buyplace": "online",
+             "satisfied": False, "bookphoto": None} for _ in range(n)]
+    await app_module.reviews_collection.insert_many(docs)
+    ctx.deletable_reviews = [(user_id, str(d["_id"])) for d in docs]
+
+
+ENDPOINTS: List[Endpoint] = [
+    Endpoint("GET /", lambda ctx, i: {"method": "GET", "url": "/"}),
+    Endpoint("GET /health", lambda ctx, i: {"method": "GET", "url": "/health"}, max_requests=5),
+    Endpoint("GET /users", lambda ctx, i: {"method": "GET", "url": "/users"}),
+    Endpoint("GET /user/{id}", lambda ctx, i: {"method": "GET", "url": f"/user/{_user(ctx, i)}"}),
+    Endpoint("GET /get-reviews", lambda ctx, i: {
+        "method": "GET", "url": "/get-reviews", "params": {"page": i % 20 + 1, "limit": 10}}),
+    Endpoint("GET /get-reviews/{user_id}", lambda ctx, i: {
+        "method": "GET", "url": f"/get-reviews/{_review(ctx, i)[0]}"}),
+    Endpoint("GET /filter", lambda ctx, i: {
+        "method": "GET", "url": "/filter",
+        "params": {"bookauthor": ctx.rng.choice(stubs.BOOKS)[1].split()[-1], "rating": ">3",
+                   "page": i % 5 + 1, "page_size": 10}}),
+    Endpoint("GET /search", lambda ctx, i: {
+        "method": "GET", "url": "/search",
+        "params": {"q": " ".join(ctx.rng.sample(stubs.WORDS, 2)), "satisfied": "true", "page": i % 5 + 1, "page_size": 10}}),
+    Endpoint("POST /login", lambda ctx, i: {
+        "method": "POST", "url": "/login",
+        "data": {"email": f"reader{i % len(ctx.user_ids)}@bench.example.com", "password": stubs.BENCH_PASSWORD}}),
+    Endpoint("POST /register", _register),
+    Endpoint("PUT /update/{user_id}", lambda ctx, i: {
+        "method": "PUT", "url": f"/update/{_user(ctx, i)}",
+        "data": {"username": f"renamed{i}", "gender": "other", "age": "31", "currentrole": "employee"}}),
+    Endpoint("POST /add-review", _add_review),
+    Endpoint("POST /add-review (session)", _add_review_with_session, setup=_setup_sessions),
+    Endpoint("PUT /update-review/{user_id}/{review_id}", _update_review),
+    Endpoint("DELETE /delete-review/{user_id}/{review_id}", lambda ctx, i: {
+        "method": "DELETE", "url": "/delete-review/{}/{}".format(*ctx.deletable_reviews[i])},
+        setup=_setup_delete_reviews),
+    Endpoint("DELETE /delete/{user_id}", lambda ctx, i: {
+        "method": "DELETE", "url": f"/delete/{ctx.deletable_users[i]}"},
+        setup=_setup_delete_users),
+]
+
+
+class RotatingClientIP:
+    """
+    ASGI wrapper that gives every request its own client address, so the
+    per-IP rate limiter is exercised without turning the run into 429s.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.counter = itertools.count(1)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            n = next(self.counter)
+            scope = dict(scope, client=(f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}", 50000))
+        await self.app(scope, receive, send)
+
+
+def install_stubs(cloudinary_latency: float, smtp_latency: float):
+    """
+    Import the app and point every module-level client at the local stand-ins.
+    """
+    import cloudinary.uploader  # type: ignore
+    import connections
+    import image_processing
+    import logging_middleware
+    import main
+
+    mongo = stubs.make_mongo_client()
+    redis_client = stubs.make_redis_client()
+
+    connections.mongo_client = mongo
+    connections.redis_client = redis_client
+
+    main.client = mongo
+    main.db = mongo["reviewverse_db"]
+    main.users_collection = main.db["users"]
+    main.reviews_collection = main.db["reviews"]
+    main.r = redis_client
+    main.send_email_via_gmail = stubs.fake_send_email(smtp_latency)
+
+    image_processing.redis_client = redis_client
+    logging_middleware.log_collection = mongo["reviewverseapp_logs"]["request_logs"]
+    logging_middleware.rollup_collection = mongo["reviewverseapp_logs"]["traffic_rollups"]
+
+    cloudinary.uploader.upload = stubs.fake_cloudinary_upload(cloudinary_latency)
+    return main
+
+
+def make_image(width: int, height: int) -> bytes:
+    image = Image.new("RGB", (width, height))
+    pixels = image.load()
+    for x in range(0, width, 4):
+        for y in range(0, height, 4):
+            pixels[x, y] = (x % 256, y % 256, (x * y) % 256)
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=95)
+    return output.getvalue()
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_endpoint(client, endpoint: Endpoint, ctx: Context, requests: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    status_codes: Dict[int, int] = {}
+    counter = itertools.count()
+
+    async def worker():
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            kwargs = endpoint.build(ctx, i)
+            start = time.perf_counter()
+            response = await client.request(**kwargs)
+            latencies.append(time.perf_counter() - start)
+            status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    errors = sum(count for code, count in status_codes.items() if code >= 400)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "status_codes": {str(code): count for code, count in sorted(status_codes.items())},
+        "throughput_rps": requests / wall if wall else 0.0,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def run(args) -> dict:
+    app_module = install_stubs(args.cloudinary_latency, args.smtp_latency)
+
+    print(f"Seeding {args.users} users and {args.reviews} reviews...")
+    user_ids, reviews = await stubs.seed(
+        app_module.users_collection, app_module.reviews_collection, args.users, args.reviews, args.seed
+    )
+    # The app builds the search index in the background at startup; build it up front here
+    search = app_module.search_service
+    search.reviews_collection, search.redis_client = app_module.reviews_collection, app_module.r
+    await search.rebuild()
+
+    ctx = Context(
+        user_ids=user_ids,
+        reviews=reviews,
+        image=make_image(args.image_width, args.image_height),
+        unique_images=args.unique_images,
+        rng=random.Random(args.seed),
+    )
+
+    # The app prints and logs every request; keep that out of the report unless asked
+    if not args.verbose:
+        logging.getLogger("RequestLogger").setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    selected = [e for e in ENDPOINTS if not args.only or any(o in e.name for o in args.only)]
+    results: Dict[str, dict] = {}
+
+    transport = httpx.ASGITransport(app=RotatingClientIP(app_module.app))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench.local", timeout=None) as client:
+        for endpoint in selected:
+            requests = min(args.requests, endpoint.max_requests or args.requests)
+            if endpoint.setup:
+                await endpoint.setup(ctx, app_module, requests + args.warmup)
+            with quiet:
+                for i in range(args.warmup):
+                    await client.request(**endpoint.build(ctx, requests + i))
+                result = await run_endpoint(client, endpoint, ctx, requests, args.concurrency)
+            results[endpoint.name] = result
+            print(f"  {endpoint.name:<45} {result['throughput_rps']:>9.1f} req/s  "
+                  f"p50 {result['p50_ms']:>8.2f}  p95 {result['p95_ms']:>8.2f}  p99 {result['p99_ms']:>8.2f} ms"
+                  + (f"  errors {result['errors']}" if result["errors"] else ""))
+
+    import image_processing
+    image_processing.shutdown_pool()
+
+    return {
+        "meta": {
+            "users": args.users,
+            "reviews": args.reviews,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "cloudinary_latency": args.cloudinary_latency,
+            "smtp_latency": args.smtp_latency,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "endpoints": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    Return a line for every endpoint whose latency rose or throughput fell by
+    more than threshold (a fraction, e.g. 0.10 for 10%) against the baseline.
+    """
+    regressions = []
+    print(f"\nComparison against baseline (threshold {threshold:.0%}):")
+    for name, result in current["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base:
+            print(f"  {name:<45} (no baseline)")
+            continue
+
+        problems = []
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if base[metric] > 0 and result[metric] > base[metric] * (1 + threshold):
+                problems.append(f"{metric} {base[metric]:.2f} -> {result[metric]:.2f}")
+        if base["throughput_rps"] > 0 and result["throughput_rps"] < base["throughput_rps"] * (1 - threshold):
+            problems.append(f"throughput {base['throughput_rps']:.1f} -> {result['throughput_rps']:.1f}")
+        if result["errors"] > base["errors"]:
+            problems.append(f"errors {base['errors']} -> {result['errors']}")
+
+        change = (result["p95_ms"] / base["p95_ms"] - 1) if base["p95_ms"] else 0.0
+        marker = "REGRESSION" if problems else "ok"
+        print(f"  {name:<45} p95 {change:>+7.1%}  {marker}  {'; '.join(problems)}")
+        if problems:
+            regressions.append(f"{name}: {'; '.join(problems)}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the ReviewVerse API")
+    parser.add_argument("--users", type=int, default=1000, help="synthetic users to seed")
+    parser.add_argument("--reviews", type=int, default=10000, help="synthetic reviews to seed")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent clients per endpoint")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for data and requests")
+    parser.add_argument("--only", nargs="*", help="run only endpoints whose name contains one of these")
+    parser.add_argument("--cloudinary-latency", type=float, default=0.0, help="simulated upload latency (s)")
+    parser.add_argument("--smtp-latency", type=float, default=0.0, help="simulated email latency (s)")
+    parser.add_argument("--image-width", type=int, default=2400)
+    parser.add_argument("--image-height", type=int, default=1800)
+    parser.add_argument("--unique-images", action="store_true", help="make every uploaded image distinct")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own request logging")
+    parser.add_argument("--output", help="write results JSON to this path")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed regression as a fraction")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} endpoint(s) regressed")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Local stand-ins for the external services used by the API.
+
+MongoDB and Redis are replaced by in-memory fakes (mongomock-motor and
+fakeredis). Cloudinary uploads and the welcome email are replaced by
+functions that only sleep for a configurable simulated latency, so the
+numbers reflect our own code rather than third-party network calls.
+"""
+import random
+import time
+import uuid
+import bcrypt  # type: ignore
+import fakeredis  # type: ignore
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient  # type: ignore
+
+BENCH_PASSWORD = "benchmark-password"
+
+BOOKS = [
+    ("The Pragmatic Programmer", "Andrew Hunt"),
+    ("Clean Code", "Robert C. Martin"),
+    ("Atomic Habits", "James Clear"),
+    ("Deep Work", "Cal Newport"),
+    ("Sapiens", "Yuval Noah Harari"),
+    ("Dune", "Frank Herbert"),
+    ("The Hobbit", "J.R.R. Tolkien"),
+    ("1984", "George Orwell"),
+    ("Thinking, Fast and Slow", "Daniel Kahneman"),
+    ("The Alchemist", "Paulo Coelho"),
+]
+
+WORDS = (
+    "story plot characters writing pacing chapter ending world ideas advice "
+    "slow brilliant boring inspiring practical dense emotional twist classic "
+    "recommend reread favourite author style translation long short"
+).split()
+
+
+def fake_cloudinary_upload(latency: float):
+    def upload(file, **options):
+        time.sleep(latency)
+        folder = options.get("folder", "bench")
+        return {"secure_url": f"https://bench.local/{folder}/{uuid.uuid4().hex}.jpg"}
+    return upload
+
+
+def fake_send_email(latency: float):
+    def send_email_via_gmail(receiver_email, receiver_name, subject=None):
+        time.sleep(latency)
+    return send_email_via_gmail
+
+
+def make_mongo_client():
+    return AsyncMongoMockClient()
+
+
+def make_redis_client():
+    return fakeredis.FakeAsyncRedis()
+
+
+def _experience(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120)))
+
+
+async def seed(users_collection, reviews_collection, users: int, reviews: int, seed_value: int):
+    """
+    Insert synthetic users and reviews. Returns the seeded user and review ids.
+    All users share one bcrypt hash so seeding stays fast at large scale while
+    /login still pays the real checkpw cost.
+    """
+    rng = random.Random(seed_value)
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+    user_docs = []
+    for i in range(users):
+        user_docs.append({
+            "_id": ObjectId(),
+            "username": f"reader{i}",
+            "email": f"reader{i}@bench.example.com",
+            "password": password_hash,
+            "profilephoto": f"https://bench.local/reviewregister/{i}.jpg",
+            "gender": rng.choice(["male", "female", "other"]),
+            "age": rng.randint(16, 70),
+            "currentrole": rng.choice(["student", "employee", "author", "other"]),
+        })
+    if user_docs:
+        await users_collection.insert_many(user_docs)
+
+    review_docs = []
+    for _ in range(reviews):
+        bookname, bookauthor = rng.choice(BOOKS)
+        review_docs.append({
+            "_id": ObjectId(),
+            "bookname": bookname,
+            "bookauthor": bookauthor,
+            "bookphoto": None,
+            "experience": _experience(rng),
+            "readingstatus": rng.choice(["start", "continue", "finished"]),
+            "rating": float(rng.randint(0, 10)) / 2,
+            "buyplace": rng.choice(["online", "offline"]),
+            "satisfied": rng.random() < 0.7,
+            "user_id": str(rng.choice(user_docs)["_id"]) if user_docs else "",
+        })
+    if review_docs:
+        await reviews_collection.insert_many(review_docs)
+
+    return [str(u["_id"]) for u in user_docs], [(r["user_id"], str(r["_id"])) for r in review_docs]
@@ -0,0 +1,179 @@
+import gzip
+import json
+import os
+from typing import Dict, Optional, Union
+from fastapi import Request, Response
+from etags import entity_tag, etag_matches, fingerprint, not_modified
+from profiling import profile_section
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent as-is, compressing them costs more than it saves
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "500"))
+
+# Levels for bodies compressed per request and for bodies compressed once and reused
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+GZIP_LEVEL_STATIC = 9
+BROTLI_QUALITY_STATIC = 11
+
+# Preferred order when the client accepts several encodings equally
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> str:
+    """
+    Pick the best encoding we support from an Accept-Encoding header.
+    Returns "identity" when the client accepts nothing we can produce.
+    """
+    if not accept_encoding:
+        return "identity"
+
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+
+    best, best_q = "identity", 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data: bytes, encoding: str, static: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY_STATIC if static else BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL_STATIC if static else GZIP_LEVEL, mtime=0)
+    return data
+
+
+def compress_all(data: bytes, static: bool = False) -> Dict[str, Union[bytes, str]]:
+    """
+    Compress a body once into every supported encoding, keyed by encoding name.
+    Each variant's ETag is stored next to it under "etag:<encoding>".
+    """
+    body_fingerprint = fingerprint(data)
+    variants: Dict[str, Union[bytes, str]] = {"identity": data}
+    if len(data) >= COMPRESSION_MIN_SIZE:
+        for encoding in SUPPORTED_ENCODINGS:
+            variants[encoding] = compress(data, encoding, static=static)
+    for encoding in list(variants):
+        variants[f"etag:{encoding}"] = entity_tag(body_fingerprint, encoding)
+    return variants
+
+
+def encoded_response(body: bytes, encoding: str, media_type: str, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    response_headers = {"Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        response_headers["Content-Encoding"] = encoding
+    if headers:
+        response_headers.update(headers)
+    return Response(content=body, media_type=media_type, status_code=status_code, headers=response_headers)
+
+
+def _validator_headers(etag: Optional[str], cache_control: Optional[str]) -> dict:
+    headers = {}
+    if etag:
+        headers["ETag"] = etag
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    return headers
+
+
+def compressed_json_response(request: Request, content, status_code: int = 200, cache_control: Optional[str] = None) -> Response:
+    """
+    Serialize content to JSON and compress it for this client on the fly.
+    """
+    with profile_section("serialization"):
+        body = json.dumps(content).encode("utf-8")
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+        if encoding == "identity" or len(body) < COMPRESSION_MIN_SIZE:
+            encoding = "identity"
+        etag = entity_tag(fingerprint(body), encoding) if status_code == 200 else None
+        if etag_matches(request, etag):
+            return not_modified(etag, cache_control)
+        if encoding != "identity":
+            body = compress(body, encoding)
+    return encoded_response(body, encoding, "application/json", status_code, _validator_headers(etag, cache_control))
+
+
+class PrecompressedPage:
+    """
+    A static body compressed once up front and served in whichever
+    encoding the client accepts, with no per-request compression.
+    """
+    def __init__(self, content: str, media_type: str = "text/html"):
+        self.media_type = media_type
+        self.variants = compress_all(content.encode("utf-8"), static=True)
+
+    def response(self, request: Request, status_code: int = 200, cache_control: Optional[str] = None) -> Response:
+        return variant_response(request, self.variants, self.media_type, status_code, cache_control)
+
+
+async def cache_compressed_json(redis_client, cache_key: str, ttl: int, content) -> Dict[str, Union[bytes, str]]:
+    """
+    Serialize content once, compress it into every supported encoding and
+    store all variants with their ETags in a Redis hash, so cache hits need
+    no compression or hashing work.
+    """
+    with profile_section("serialization"):
+        variants = compress_all(json.dumps(content).encode("utf-8"))
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(cache_key)
+        pipe.hset(cache_key, mapping=variants)
+        pipe.expire(cache_key, ttl)
+        await pipe.execute()
+    return variants
+
+
+def variant_response(request: Request, variants: Dict[str, Union[bytes, str]], media_type: str = "application/json", status_code: int = 200, cache_control: Optional[str] = None) -> Response:
+    """
+    Pick the client's encoding from a set of precompressed variants.
+    Answers 304 if the client already has this body.
+    """
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    if encoding not in variants:
+        encoding = "identity"
+    etag = variants.get(f"etag:{encoding}") if status_code == 200 else None
+    if etag_matches(request, etag):
+        return not_modified(etag, cache_control)
+    return encoded_response(variants[encoding], encoding, media_type, status_code, _validator_headers(etag, cache_control))
+
+
+async def get_cached_response(redis_client, cache_key: str, request: Request, cache_control: Optional[str] = None) -> Optional[Response]:
+    """
+    Serve a cached JSON body straight from Redis in the client's encoding.
+    A conditional request whose ETag still matches gets a 304 without the
+    body ever leaving Redis. Returns None on a cache miss.
+    """
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+
+    if request.headers.get("if-none-match"):
+        etag = await redis_client.hget(cache_key, f"etag:{encoding}")
+        if etag is None and encoding != "identity":
+            etag = await redis_client.hget(cache_key, "etag:identity")
+        if etag is not None and etag_matches(request, etag.decode("utf-8")):
+            return not_modified(etag.decode("utf-8"), cache_control)
+
+    body, etag = await redis_client.hmget(cache_key, [encoding, f"etag:{encoding}"])
+    if body is None and encoding != "identity":
+        # Small bodies are only stored uncompressed
+        encoding = "identity"
+        body, etag = await redis_client.hmget(cache_key, [encoding, f"etag:{encoding}"])
+    if body is None:
+        return None
+    etag = etag.decode("utf-8") if etag else None
+    return encoded_response(body, encoding, "application/json", headers=_validator_headers(etag, cache_control))
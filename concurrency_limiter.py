@@ -0,0 +1,186 @@
+"""
+Server-wide adaptive concurrency limiting with priority load shedding.
+
+Each worker caps how many requests it serves at once. The cap follows
+observed latency (a gradient limiter): while recent latency stays close
+to the long-term average the limit grows, and when requests start queueing
+and latency rises the limit shrinks in proportion.
+
+Requests are split into priority classes that may only use part of the
+limit, so expensive work (/register, /filter, /search) is turned away
+first with 503 and Retry-After while cheap reads keep being served.
+Requests over the limit are rejected immediately instead of waiting in an
+unbounded queue on the event loop.
+"""
+import json
+import math
+import os
+import time
+from typing import Dict, Optional
+
+CONCURRENCY_LIMIT_ENABLED = os.getenv("CONCURRENCY_LIMIT_ENABLED", "True") == "True"
+
+# Starting limit and the range it may move in
+CONCURRENCY_INITIAL_LIMIT = int(os.getenv("CONCURRENCY_INITIAL_LIMIT", "50"))
+CONCURRENCY_MIN_LIMIT = int(os.getenv("CONCURRENCY_MIN_LIMIT", "10"))
+CONCURRENCY_MAX_LIMIT = int(os.getenv("CONCURRENCY_MAX_LIMIT", "1000"))
+
+# Recent latency may reach this multiple of the long-term average before the limit shrinks
+CONCURRENCY_TOLERANCE = float(os.getenv("CONCURRENCY_TOLERANCE", "1.5"))
+
+# Share of the limit each priority class may fill
+CONCURRENCY_NORMAL_SHARE = float(os.getenv("CONCURRENCY_NORMAL_SHARE", "0.8"))
+CONCURRENCY_SHEDDABLE_SHARE = float(os.getenv("CONCURRENCY_SHEDDABLE_SHARE", "0.5"))
+
+# Comma-separated path prefixes that are shed first
+CONCURRENCY_SHEDDABLE_PATHS = tuple(
+    p.strip() for p in os.getenv("CONCURRENCY_SHEDDABLE_PATHS", "/register,/filter,/search").split(",") if p.strip()
+)
+
+# Seconds clients are told to wait before retrying a shed request
+CONCURRENCY_RETRY_AFTER = int(os.getenv("CONCURRENCY_RETRY_AFTER", "1"))
+
+# Monitoring endpoints are never shed
+EXEMPT_PATHS = ("/health", "/concurrency-stats")
+
+# Limit updates: at least this many samples and this many seconds per window
+WINDOW_MIN_SAMPLES = 10
+WINDOW_SECONDS = 0.5
+
+# Long-term latency average spans roughly this many windows
+LONG_WINDOWS = 60
+
+# Weight of each new limit estimate
+SMOOTHING = 0.2
+
+CRITICAL, NORMAL, SHEDDABLE = "critical", "normal", "sheddable"
+PRIORITY_SHARES = {CRITICAL: 1.0, NORMAL: CONCURRENCY_NORMAL_SHARE, SHEDDABLE: CONCURRENCY_SHEDDABLE_SHARE}
+
+
+def request_priority(method: str, path: str) -> str:
+    if path.startswith(CONCURRENCY_SHEDDABLE_PATHS):
+        return SHEDDABLE
+    # Reads are cheap (mostly served from Redis); writes hash passwords, upload images and hit MongoDB
+    if method in ("GET", "HEAD"):
+        return CRITICAL
+    return NORMAL
+
+
+class AdaptiveLimiter:
+    def __init__(self):
+        self.limit = float(CONCURRENCY_INITIAL_LIMIT)
+        self.inflight = 0
+        self.long_rtt: Optional[float] = None
+        self.short_rtt: Optional[float] = None
+        self.window_start = time.monotonic()
+        self.window_total = 0.0
+        self.window_samples = 0
+        self.window_peak = 0
+        self.priority_inflight: Dict[str, int] = {priority: 0 for priority in PRIORITY_SHARES}
+        self.admitted: Dict[str, int] = {priority: 0 for priority in PRIORITY_SHARES}
+        self.shed: Dict[str, int] = {priority: 0 for priority in PRIORITY_SHARES}
+
+    def priority_limit(self, priority: str) -> int:
+        return max(1, int(self.limit * PRIORITY_SHARES[priority]))
+
+    def try_acquire(self, priority: str) -> bool:
+        # Every class counts everything in flight, so a lower class only
+        # gets in while there is headroom left for the classes above it
+        if self.inflight >= self.priority_limit(priority):
+            self.shed[priority] += 1
+            return False
+        self.inflight += 1
+        self.priority_inflight[priority] += 1
+        self.admitted[priority] += 1
+        self.window_peak = max(self.window_peak, self.inflight)
+        return True
+
+    def release(self, priority: str, latency: float):
+        self.inflight -= 1
+        self.priority_inflight[priority] -= 1
+        self.window_total += latency
+        self.window_samples += 1
+        now = time.monotonic()
+        if self.window_samples >= WINDOW_MIN_SAMPLES and now - self.window_start >= WINDOW_SECONDS:
+            self._update(self.window_total / self.window_samples)
+            self.window_start = now
+            self.window_total = 0.0
+            self.window_samples = 0
+            self.window_peak = self.inflight
+
+    def _update(self, short_rtt: float):
+        self.short_rtt = short_rtt
+        if self.long_rtt is None:
+            self.long_rtt = short_rtt
+        else:
+            self.long_rtt += (short_rtt - self.long_rtt) * 2 / (LONG_WINDOWS + 1)
+            # After an overload the long-term average is inflated; let it fall back quickly
+            if self.long_rtt > short_rtt * CONCURRENCY_TOLERANCE:
+                self.long_rtt *= 0.9
+
+        gradient = max(0.5, min(1.0, CONCURRENCY_TOLERANCE * self.long_rtt / short_rtt))
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        # Don't grow a limit the traffic isn't using
+        if new_limit > self.limit and self.window_peak < self.limit / 2:
+            new_limit = self.limit
+        self.limit = max(CONCURRENCY_MIN_LIMIT, min(CONCURRENCY_MAX_LIMIT, self.limit * (1 - SMOOTHING) + new_limit * SMOOTHING))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": CONCURRENCY_LIMIT_ENABLED,
+            "limit": round(self.limit, 1),
+            "inflight": self.inflight,
+            "short_latency_ms": round(self.short_rtt * 1000, 2) if self.short_rtt is not None else None,
+            "long_latency_ms": round(self.long_rtt * 1000, 2) if self.long_rtt is not None else None,
+            "priorities": {
+                priority: {
+                    "limit": self.priority_limit(priority),
+                    "inflight": self.priority_inflight[priority],
+                    "admitted": self.admitted[priority],
+                    "shed": self.shed[priority],
+                }
+                for priority in PRIORITY_SHARES
+            },
+        }
+
+
+limiter = AdaptiveLimiter()
+
+SHED_BODY = json.dumps({"detail": "Server is busy. Please try again shortly."}).encode("utf-8")
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Plain ASGI middleware so a shed request costs no more than writing the 503.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not CONCURRENCY_LIMIT_ENABLED or scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        priority = request_priority(scope["method"], scope["path"])
+        if not limiter.try_acquire(priority):
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(SHED_BODY)).encode("latin-1")),
+                    (b"retry-after", str(CONCURRENCY_RETRY_AFTER).encode("latin-1")),
+                ],
+            })
+            await send({"type": "http.response.body", "body": SHED_BODY})
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(priority, time.perf_counter() - start)
+
+
+def concurrency_stats() -> dict:
+    return limiter.stats()
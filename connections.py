@@ -0,0 +1,111 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from motor.motor_asyncio import AsyncIOMotorClient
+import redis.asyncio as redis  # type: ignore
+from dotenv import load_dotenv
+from mongo_monitoring import command_monitor
+from profiling import MongoProfilingListener, ProfiledConnection, ProfiledSSLConnection
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# MongoDB pool settings
+MONGO_MAX_POOL_SIZE = _env_int("MONGO_MAX_POOL_SIZE", 50)
+MONGO_MIN_POOL_SIZE = _env_int("MONGO_MIN_POOL_SIZE", 5)
+MONGO_MAX_IDLE_TIME_MS = _env_int("MONGO_MAX_IDLE_TIME_MS", 300000)
+MONGO_CONNECT_TIMEOUT_MS = _env_int("MONGO_CONNECT_TIMEOUT_MS", 5000)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
+MONGO_SOCKET_TIMEOUT_MS = _env_int("MONGO_SOCKET_TIMEOUT_MS", 20000)
+
+# Redis pool settings
+REDIS_MAX_CONNECTIONS = _env_int("REDIS_MAX_CONNECTIONS", 50)
+REDIS_SOCKET_TIMEOUT = _env_float("REDIS_SOCKET_TIMEOUT", 5.0)
+REDIS_SOCKET_CONNECT_TIMEOUT = _env_float("REDIS_SOCKET_CONNECT_TIMEOUT", 5.0)
+REDIS_HEALTH_CHECK_INTERVAL = _env_int("REDIS_HEALTH_CHECK_INTERVAL", 30)
+
+# Number of Redis connections opened before the app starts serving traffic
+REDIS_WARMUP_CONNECTIONS = _env_int("REDIS_WARMUP_CONNECTIONS", 5)
+
+
+# One MongoDB client per worker process, shared by the API and the logging middleware.
+# Motor connects lazily, so creating the client here does not open any sockets yet.
+mongo_client = AsyncIOMotorClient(
+    os.getenv("MONGO_URI"),
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    event_listeners=[command_monitor, MongoProfilingListener()],
+)
+
+# One Redis client (and connection pool) per worker process.
+# The connection classes report command time to profiled requests.
+redis_ssl = os.getenv("REDIS_SSL") == "True"
+redis_pool = redis.ConnectionPool(
+    connection_class=ProfiledSSLConnection if redis_ssl else ProfiledConnection,
+    host=os.getenv("REDIS_HOST"),
+    port=os.getenv("REDIS_PORT"),
+    password=os.getenv("REDIS_PASSWORD"),
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+    socket_keepalive=True,
+    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+)
+redis_client = redis.Redis.from_pool(redis_pool)
+
+
+async def warm_up():
+    """
+    Open connections before the first request so it does not pay for
+    DNS, TCP and TLS handshakes.
+    """
+    try:
+        # Forces server selection and opens the first pooled socket;
+        # the driver then fills the pool up to minPoolSize in the background.
+        await mongo_client.admin.command("ping")
+        print("MongoDB connection pool warmed up")
+    except Exception as e:
+        print(f"Error warming up MongoDB: {e}")
+
+    try:
+        # Concurrent pings force the pool to open several connections at once
+        warmup_count = min(REDIS_WARMUP_CONNECTIONS, REDIS_MAX_CONNECTIONS)
+        await asyncio.gather(*(redis_client.ping() for _ in range(warmup_count)))
+        print(f"Redis connection pool warmed up with {warmup_count} connections")
+    except Exception as e:
+        print(f"Error warming up Redis: {e}")
+
+
+async def close():
+    """
+    Close every pooled connection on shutdown.
+    """
+    try:
+        await redis_client.aclose()
+    except Exception as e:
+        print(f"Error closing Redis connections: {e}")
+
+    mongo_client.close()
+    print("Database connections closed")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await warm_up()
+    yield
+    await close()
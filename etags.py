@@ -0,0 +1,48 @@
+import hashlib
+from typing import Optional
+from fastapi import Request, Response
+
+
+def fingerprint(body: bytes) -> str:
+    """
+    Cheap content fingerprint of an uncompressed response body.
+    """
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def entity_tag(body_fingerprint: str, encoding: str) -> str:
+    """
+    Strong ETag for one encoding of a body. Each content-coding is its own
+    representation, so compressed variants carry the encoding as a suffix.
+    """
+    if encoding == "identity":
+        return f'"{body_fingerprint}"'
+    return f'"{body_fingerprint}-{encoding}"'
+
+
+def _opaque_fingerprint(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    return tag.strip('"').split("-", 1)[0]
+
+
+def etag_matches(request: Request, etag: Optional[str]) -> bool:
+    """
+    True if the request's If-None-Match covers this ETag. Variants of the
+    same body match each other, so a client switching encodings still gets 304.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    current = _opaque_fingerprint(etag)
+    return any(_opaque_fingerprint(tag) == current for tag in if_none_match.split(","))
+
+
+def not_modified(etag: str, cache_control: Optional[str] = None) -> Response:
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    return Response(status_code=304, headers=headers)
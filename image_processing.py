@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import cloudinary.uploader  # type: ignore
+from fastapi import HTTPException, UploadFile
+from PIL import Image, ImageOps, UnidentifiedImageError  # type: ignore
+from connections import redis_client
+from profiling import profile_section
+
+# Preprocessing settings
+IMAGE_MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", "1024"))
+IMAGE_MAX_HEIGHT = int(os.getenv("IMAGE_MAX_HEIGHT", "1024"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "82"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# Limits on what an upload may be: file size, and decoded size (a small file can
+# declare a huge image). Pillow's own bomb check uses the same pixel cap.
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(40_000_000)))
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+# Redis hash -> secure_url index, one key per folder and content hash
+IMAGE_HASH_KEY_PREFIX = "image_hash"
+IMAGE_HASH_TTL = int(os.getenv("IMAGE_HASH_TTL", str(90 * 24 * 3600)))  # 90 days
+
+# Created on first use so importing this module does not fork workers
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Never fork: by the first upload the driver and executor threads are running,
+        # and a forked child can deadlock on locks those threads held
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def preprocess_image(data: bytes, max_width: int, max_height: int, quality: int, max_pixels: int) -> bytes:
+    """
+    Downscale an image to fit within max_width x max_height and recompress it.
+    Runs in a worker process. Returns the original bytes if the file is not a
+    readable image or if recompressing would not make it smaller.
+    Raises ImageTooLarge for images over max_pixels.
+    """
+    try:
+        # open() only reads the header, so the size is checked before any decoding
+        image = Image.open(io.BytesIO(data))
+        if image.width * image.height > max_pixels:
+            raise ImageTooLarge(f"{image.width}x{image.height}")
+        original_size = image.size
+        # JPEGs can decode straight at a fraction of their size; the box is square
+        # because EXIF rotation may swap width and height afterwards
+        image.draft("RGB", (max(max_width, max_height), max(max_width, max_height)))
+        image = ImageOps.exif_transpose(image)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except (UnidentifiedImageError, OSError):
+        return data
+
+    resized = image.size != original_size or image.width > max_width or image.height > max_height
+    if resized:
+        image.thumbnail((max_width, max_height), Image.LANCZOS)
+
+    output = io.BytesIO()
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if has_alpha:
+        image.save(output, format="PNG", optimize=True)
+    else:
+        image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True, progressive=True)
+
+    processed = output.getvalue()
+    if not resized and len(processed) >= len(data):
+        return data
+    return processed
+
+
+async def upload_image(upload: UploadFile, folder: str) -> str:
+    """
+    Upload an image to Cloudinary and return its secure_url.
+    Identical files (by SHA-256 of the uploaded bytes) reuse the URL stored
+    in Redis and skip both preprocessing and the upload.
+    """
+    data = await upload.read(IMAGE_MAX_UPLOAD_BYTES + 1)
+    if len(data) > IMAGE_MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image is too large. The limit is {IMAGE_MAX_UPLOAD_BYTES // (1024 * 1024)} MB."
+        )
+    content_hash = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+    cache_key = f"{IMAGE_HASH_KEY_PREFIX}:{folder}:{content_hash}"
+
+    try:
+        cached_url = await redis_client.get(cache_key)
+        if cached_url:
+            return cached_url.decode("utf-8")
+    except Exception as e:
+        print(f"Error reading image hash from Redis: {e}")
+
+    loop = asyncio.get_running_loop()
+    try:
+        processed = await loop.run_in_executor(
+            _get_pool(), preprocess_image, data, IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT, IMAGE_JPEG_QUALITY, IMAGE_MAX_PIXELS
+        )
+    except ImageTooLarge:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Image dimensions are too large. The limit is {IMAGE_MAX_PIXELS // 1_000_000} megapixels."
+        )
+
+    # The Cloudinary SDK is blocking, so keep it off the event loop
+    with profile_section("cloudinary"):
+        upload_result = await asyncio.to_thread(
+            cloudinary.uploader.upload, io.BytesIO(processed), folder=folder
+        )
+    photo_url = upload_result['secure_url']
+
+    try:
+        await redis_client.setex(cache_key, IMAGE_HASH_TTL, photo_url)
+    except Exception as e:
+        print(f"Error saving image hash to Redis: {e}")
+
+    return photo_url
@@ -0,0 +1,324 @@
+"""
+Book leaderboards kept in Redis sorted sets.
+
+Every review write updates three boards atomically (one Lua script call):
+- top rated: average rating, only for books with at least LEADERBOARD_MIN_REVIEWS reviews
+- most reviewed: all-time review count
+- trending: review velocity with exponential time decay
+
+Top-K reads are a single ZREVRANGE, O(log N + K).
+
+The app builds the boards from MongoDB on startup if they have never been
+built. Rebuild them (e.g. weekly, to reset the trending time base) with:
+    python leaderboards.py --rebuild
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from recommendations import book_key
+
+# Minimum number of reviews before a book can appear on the top-rated board
+LEADERBOARD_MIN_REVIEWS = int(os.getenv("LEADERBOARD_MIN_REVIEWS", "3"))
+
+# A review's weight on the trending board halves every this many hours
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "24"))
+
+RATING_SUM_KEY = "lb:rating_sum"
+RATING_COUNT_KEY = "lb:rating_count"
+TOP_RATED_KEY = "lb:top_rated"
+MOST_REVIEWED_KEY = "lb:most_reviewed"
+TRENDING_KEY = "lb:trending"
+TRENDING_EPOCH_KEY = "lb:trending_epoch"
+TITLES_KEY = "lb:titles"
+
+# Set when a rebuild swaps its boards in; missing means the boards were never built
+BUILT_KEY = "lb:built_at"
+
+# Held while a rebuild runs; reviews written meanwhile are collected in the touched set
+REBUILD_LOCK_KEY = "lb:rebuild_lock"
+REBUILD_TOUCHED_KEY = "lb:rebuild_touched"
+LEADERBOARD_REBUILD_LOCK_SECONDS = int(os.getenv("LEADERBOARD_REBUILD_LOCK_SECONDS", "3600"))
+
+# Rebuild attempts to reconcile concurrent writes before giving up
+REBUILD_MAX_ATTEMPTS = 5
+
+ALL_KEYS = [RATING_SUM_KEY, RATING_COUNT_KEY, TOP_RATED_KEY, MOST_REVIEWED_KEY, TRENDING_KEY, TRENDING_EPOCH_KEY, TITLES_KEY]
+
+# Trending scores are stored as sum(2 ** ((created - epoch) / half_life)) so
+# they never need rewriting as time passes; dividing by 2 ** ((now - epoch) / half_life)
+# at read time gives the decayed value. Stored scores grow by 2x per half-life,
+# so run the rebuild (which resets the epoch) periodically, e.g. weekly.
+# A book whose stored (not yet decayed) score drops to 1e-6 or below leaves the board;
+# in practice that happens once all of its reviews have been removed.
+# While a rebuild runs, the review id is also recorded so the rebuild can re-read it.
+APPLY_REVIEW_SCRIPT = """
+if redis.call('EXISTS', KEYS[8]) == 1 then
+    redis.call('SADD', KEYS[9], ARGV[8])
+end
+local book = ARGV[1]
+local delta = tonumber(ARGV[3])
+local sum = tonumber(redis.call('HINCRBYFLOAT', KEYS[1], book, ARGV[2]))
+local count = redis.call('HINCRBY', KEYS[2], book, delta)
+if count <= 0 then
+    redis.call('HDEL', KEYS[1], book)
+    redis.call('HDEL', KEYS[2], book)
+    redis.call('ZREM', KEYS[3], book)
+    redis.call('ZREM', KEYS[4], book)
+    redis.call('ZREM', KEYS[5], book)
+    redis.call('HDEL', KEYS[7], book)
+    return 0
+end
+redis.call('ZADD', KEYS[4], count, book)
+if count >= tonumber(ARGV[4]) then
+    redis.call('ZADD', KEYS[3], sum / count, book)
+else
+    redis.call('ZREM', KEYS[3], book)
+end
+redis.call('HSETNX', KEYS[7], book, ARGV[7])
+local epoch = tonumber(redis.call('GET', KEYS[6]))
+if not epoch then
+    epoch = tonumber(ARGV[5])
+    redis.call('SET', KEYS[6], ARGV[5])
+end
+local weight = delta * math.pow(2, (tonumber(ARGV[5]) - epoch) / tonumber(ARGV[6]))
+local score = tonumber(redis.call('ZINCRBY', KEYS[5], weight, book))
+if score <= 1e-6 then
+    redis.call('ZREM', KEYS[5], book)
+end
+return count
+"""
+
+# Swap staged boards in, unless reviews were written since the rebuild last
+# read them (returns 0) or the rebuild no longer holds the lock (returns -1).
+# KEYS: lock, touched set, built marker, then (live, staged) pairs
+SWAP_BOARDS_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return -1
+end
+if redis.call('SCARD', KEYS[2]) > 0 then
+    return 0
+end
+for i = 4, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i + 1]) == 1 then
+        redis.call('RENAME', KEYS[i + 1], KEYS[i])
+    else
+        redis.call('DEL', KEYS[i])
+    end
+end
+redis.call('SET', KEYS[3], ARGV[2])
+redis.call('DEL', KEYS[1], KEYS[2])
+return 1
+"""
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+end
+"""
+
+
+def _half_life_seconds() -> float:
+    return TRENDING_HALF_LIFE_HOURS * 3600
+
+
+async def apply_review(redis_client, bookname: str, bookauthor: str, rating: float, created: float, delta: int = 1, review_id: str = ""):
+    """
+    Add (delta=1) or remove (delta=-1) one review's contribution to every board.
+    created is the review's creation time as a Unix timestamp.
+    """
+    if not bookname or not bookauthor or rating is None:
+        return
+    try:
+        script = redis_client.register_script(APPLY_REVIEW_SCRIPT)
+        await script(
+            keys=[RATING_SUM_KEY, RATING_COUNT_KEY, TOP_RATED_KEY, MOST_REVIEWED_KEY, TRENDING_KEY, TRENDING_EPOCH_KEY, TITLES_KEY,
+                  REBUILD_LOCK_KEY, REBUILD_TOUCHED_KEY],
+            args=[
+                book_key(bookname, bookauthor),
+                float(rating) * delta,
+                delta,
+                LEADERBOARD_MIN_REVIEWS,
+                created,
+                _half_life_seconds(),
+                json.dumps([bookname, bookauthor]),
+                review_id,
+            ],
+        )
+    except Exception as e:
+        print(f"Error updating leaderboards: {e}")
+
+
+async def record_review(redis_client, review: dict, created: float):
+    await apply_review(redis_client, review.get("bookname"), review.get("bookauthor"), review.get("rating"), created, 1, str(review.get("_id", "")))
+
+
+async def remove_review(redis_client, review: dict, created: float):
+    await apply_review(redis_client, review.get("bookname"), review.get("bookauthor"), review.get("rating"), created, -1, str(review.get("_id", "")))
+
+
+async def top_books(redis_client, board: str, limit: int) -> List[dict]:
+    """
+    Top `limit` books on a board, highest score first.
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zrevrange(board, 0, limit - 1, withscores=True)
+        pipe.get(TRENDING_EPOCH_KEY)
+        entries, epoch = await pipe.execute()
+    if not entries:
+        return []
+
+    titles = await redis_client.hmget(TITLES_KEY, [member for member, _ in entries])
+    decay = 1.0
+    if board == TRENDING_KEY and epoch is not None:
+        decay = math.pow(2, -(time.time() - float(epoch)) / _half_life_seconds())
+
+    books = []
+    for (member, score), title in zip(entries, titles):
+        bookname, bookauthor = json.loads(title) if title else (None, None)
+        books.append({"bookname": bookname, "bookauthor": bookauthor, "score": round(score * decay, 4)})
+    return books
+
+
+def _review_entry(review: dict) -> Optional[Tuple[str, str, float, float]]:
+    if review.get("bookname") and review.get("bookauthor") and review.get("rating") is not None:
+        return review["bookname"], review["bookauthor"], float(review["rating"]), review["_id"].generation_time.timestamp()
+    return None
+
+
+def _rebuild_entries(reviews, now: float):
+    sums, counts, trending, titles = {}, {}, {}, {}
+    half_life = _half_life_seconds()
+    for bookname, bookauthor, rating, created in reviews:
+        key = book_key(bookname, bookauthor)
+        sums[key] = sums.get(key, 0.0) + rating
+        counts[key] = counts.get(key, 0) + 1
+        trending[key] = trending.get(key, 0.0) + math.pow(2, (created - now) / half_life)
+        titles.setdefault(key, json.dumps([bookname, bookauthor]))
+    top_rated = {k: sums[k] / counts[k] for k in counts if counts[k] >= LEADERBOARD_MIN_REVIEWS}
+    return sums, counts, top_rated, trending, titles
+
+
+async def rebuild(reviews_collection, redis_client, batch: int = 5000) -> Optional[int]:
+    """
+    Regenerate every board from MongoDB. The new boards are written under
+    temporary keys and swapped in atomically, so readers never see a partial board.
+
+    Reviews written while MongoDB is scanned are recorded by the write path;
+    they are read again and folded in before the swap, and the swap is retried
+    if more arrive while the boards are staged. Returns the number of reviews
+    processed, or None if another rebuild holds the lock.
+    """
+    token = uuid.uuid4().hex
+    if not await redis_client.set(REBUILD_LOCK_KEY, token, nx=True, ex=LEADERBOARD_REBUILD_LOCK_SECONDS):
+        return None
+    swapped = False
+    try:
+        await redis_client.delete(REBUILD_TOUCHED_KEY)
+        reviews: Dict[ObjectId, Tuple[str, str, float, float]] = {}
+        cursor = reviews_collection.find({}, {"bookname": 1, "bookauthor": 1, "rating": 1})
+        async for review in cursor:
+            entry = _review_entry(review)
+            if entry:
+                reviews[review["_id"]] = entry
+
+        for _ in range(REBUILD_MAX_ATTEMPTS):
+            await _refresh_touched(reviews_collection, redis_client, reviews)
+            now = time.time()
+            staged = await _stage_boards(redis_client, reviews.values(), now, batch)
+
+            script = redis_client.register_script(SWAP_BOARDS_SCRIPT)
+            keys = [REBUILD_LOCK_KEY, REBUILD_TOUCHED_KEY, BUILT_KEY]
+            for key in ALL_KEYS:
+                keys += [key, staged[key]]
+            result = await script(keys=keys, args=[token, now])
+            if result == 1:
+                swapped = True
+                return len(reviews)
+            if result == -1:
+                raise RuntimeError("leaderboard rebuild lock expired; raise LEADERBOARD_REBUILD_LOCK_SECONDS")
+        raise RuntimeError(f"reviews kept changing during {REBUILD_MAX_ATTEMPTS} leaderboard rebuild attempts")
+    finally:
+        if not swapped:
+            await redis_client.register_script(RELEASE_LOCK_SCRIPT)(keys=[REBUILD_LOCK_KEY, REBUILD_TOUCHED_KEY], args=[token])
+
+
+async def _refresh_touched(reviews_collection, redis_client, reviews: Dict[ObjectId, Tuple[str, str, float, float]]):
+    # Re-read reviews written since the last pass, taking them out of the touched set
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.smembers(REBUILD_TOUCHED_KEY)
+        pipe.delete(REBUILD_TOUCHED_KEY)
+        touched, _ = await pipe.execute()
+    ids = [ObjectId(i.decode("utf-8")) for i in touched if ObjectId.is_valid(i.decode("utf-8"))]
+    for review_id in ids:
+        reviews.pop(review_id, None)
+    if ids:
+        async for review in reviews_collection.find({"_id": {"$in": ids}}, {"bookname": 1, "bookauthor": 1, "rating": 1}):
+            entry = _review_entry(review)
+            if entry:
+                reviews[review["_id"]] = entry
+
+
+async def _stage_boards(redis_client, reviews, now: float, batch: int) -> Dict[str, str]:
+    sums, counts, top_rated, trending, titles = _rebuild_entries(reviews, now)
+    staged = {key: f"{key}:rebuild" for key in ALL_KEYS}
+
+    hashes = {RATING_SUM_KEY: sums, RATING_COUNT_KEY: counts, TITLES_KEY: titles}
+    sorted_sets = {MOST_REVIEWED_KEY: counts, TOP_RATED_KEY: top_rated, TRENDING_KEY: trending}
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.delete(*staged.values())
+        for key, values in list(hashes.items()) + list(sorted_sets.items()):
+            items = list(values.items())
+            for start in range(0, len(items), batch):
+                chunk = dict(items[start:start + batch])
+                if key in hashes:
+                    pipe.hset(staged[key], mapping=chunk)
+                else:
+                    pipe.zadd(staged[key], chunk)
+        pipe.set(staged[TRENDING_EPOCH_KEY], now)
+        await pipe.execute()
+    return staged
+
+
+async def ensure_built(reviews_collection, redis_client):
+    """
+    Build the boards on first deploy. Updates and deletes subtract what a
+    review added, so boards missing older reviews would drop books entirely.
+    """
+    try:
+        if await redis_client.exists(BUILT_KEY):
+            return
+        start = time.perf_counter()
+        count = await rebuild(reviews_collection, redis_client)
+        if count is not None:
+            print(f"Built leaderboards from {count} reviews in {time.perf_counter() - start:.2f} seconds")
+    except Exception as e:
+        print(f"Error building leaderboards: {e}")
+
+
+async def _main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Manage ReviewVerse leaderboards")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate all leaderboards from MongoDB")
+    args = parser.parse_args(argv)
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    import connections
+    start = time.perf_counter()
+    count = await rebuild(connections.mongo_client["reviewverse_db"]["reviews"], connections.redis_client)
+    if count is None:
+        print("Another leaderboard rebuild is already running")
+    else:
+        print(f"Rebuilt leaderboards from {count} reviews in {time.perf_counter() - start:.2f} seconds")
+    await connections.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
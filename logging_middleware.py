@@ -1,37 +1,212 @@
+import asyncio
 import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
 from starlette.middleware.base import BaseHTTPMiddleware
 from fastapi import Request, Response
-from pymongo import MongoClient
-from datetime import datetime
-import os
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure
+from connections import mongo_client
 
 # Set up logging to console (optional)
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
 logger = logging.getLogger("RequestLogger")
 
+# How long raw request logs and per-minute rollups are kept
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "14"))
+ROLLUP_RETENTION_DAYS = int(os.getenv("ROLLUP_RETENTION_DAYS", "90"))
+
+# Logs and rollups are buffered in memory and written in batches this often (seconds)
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "10"))
+
+# Raw log entries held between flushes; extra entries are dropped (rollups still count them)
+LOG_BUFFER_MAX = int(os.getenv("LOG_BUFFER_MAX", "10000"))
+
 # MongoDB setup
-client = AsyncIOMotorClient(os.getenv("MONGO_URI"))  # Adjust your MongoDB URI
+client = mongo_client  # Shared client, pool is managed by the app lifespan
 db = client['reviewverseapp_logs']  # Database name
-collection = db['logs']  # Collection name
+log_collection = db['request_logs']  # Time-series (or TTL-indexed) raw request logs
+rollup_collection = db['traffic_rollups']  # Per-minute request counts by path, status and client IP
+
+ROLLUP_GROUPS = ("path", "status_code", "client_ip", "minute")
+
+
+async def ensure_log_storage():
+    """
+    Create the log collections with bounded retention. Raw logs go to a
+    time-series collection that expires old buckets; servers without
+    time-series support get a TTL index instead. Safe to call on every start;
+    errors (e.g. MongoDB unreachable) are logged so the app still starts.
+    """
+    retention = LOG_RETENTION_DAYS * 24 * 3600
+    try:
+        try:
+            await db.create_collection(
+                log_collection.name,
+                timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": "seconds"},
+                expireAfterSeconds=retention,
+            )
+        except (CollectionInvalid, OperationFailure):
+            # Already exists (or time-series unsupported): make sure retention is current
+            try:
+                await db.command({"collMod": log_collection.name, "expireAfterSeconds": retention})
+            except OperationFailure:
+                try:
+                    await log_collection.create_index("timestamp", expireAfterSeconds=retention, name="timestamp_ttl")
+                except OperationFailure:
+                    await db.command({"collMod": log_collection.name, "index": {"name": "timestamp_ttl", "expireAfterSeconds": retention}})
+    except Exception as e:
+        logger.error(f"Error setting up request log retention: {e}")
+
+    try:
+        await rollup_collection.create_index(
+            [("minute", 1), ("path", 1), ("status_code", 1), ("client_ip", 1)],
+            unique=True, name="rollup_key",
+        )
+        rollup_retention = ROLLUP_RETENTION_DAYS * 24 * 3600
+        try:
+            await rollup_collection.create_index("minute", expireAfterSeconds=rollup_retention, name="minute_ttl")
+        except OperationFailure:
+            await db.command({"collMod": rollup_collection.name, "index": {"name": "minute_ttl", "expireAfterSeconds": rollup_retention}})
+    except Exception as e:
+        logger.error(f"Error creating traffic rollup indexes: {e}")
+
+
+class TrafficRecorder:
+    """
+    Buffers raw request logs and per-minute rollups in memory and flushes
+    them to MongoDB in batches from a background task.
+    """
+    def __init__(self):
+        self.pending_logs: List[dict] = []
+        self.rollups: Dict[Tuple[datetime, str, int, str], int] = defaultdict(int)
+        self.dropped_logs = 0
+        self.task = None
+
+    def record(self, client_ip: str, path: str, route_path: str, status_code: int):
+        timestamp = datetime.now(timezone.utc)
+        if len(self.pending_logs) < LOG_BUFFER_MAX:
+            self.pending_logs.append({
+                "timestamp": timestamp,
+                "meta": {"client_ip": client_ip, "path": path, "status_code": status_code},
+            })
+        else:
+            self.dropped_logs += 1
+        minute = timestamp.replace(second=0, microsecond=0)
+        self.rollups[(minute, route_path, status_code, client_ip)] += 1
+
+    async def flush(self):
+        # Swap the buffers first so requests served during the writes start a new batch
+        logs, self.pending_logs = self.pending_logs, []
+        rollups, self.rollups = self.rollups, defaultdict(int)
+        dropped, self.dropped_logs = self.dropped_logs, 0
+        if dropped:
+            logger.warning(f"Dropped {dropped} request logs, buffer was full")
+
+        # Writes that fail go back into the buffers for the next flush; rollup
+        # counts are additive, so they merge with whatever arrived meanwhile
+        error = None
+        if logs:
+            try:
+                await log_collection.insert_many(logs, ordered=False)
+            except BulkWriteError as e:
+                # Unordered: only the reported documents were not written
+                self._requeue_logs([logs[failure["index"]] for failure in e.details.get("writeErrors", [])])
+                error = e
+            except Exception as e:
+                self._requeue_logs(logs)
+                error = e
+        if rollups:
+            keys = list(rollups)
+            try:
+                await rollup_collection.bulk_write([
+                    UpdateOne(
+                        {"minute": minute, "path": path, "status_code": status_code, "client_ip": client_ip},
+                        {"$inc": {"count": rollups[(minute, path, status_code, client_ip)]}},
+                        upsert=True,
+                    )
+                    for minute, path, status_code, client_ip in keys
+                ], ordered=False)
+            except BulkWriteError as e:
+                self._requeue_rollups({keys[failure["index"]]: rollups[keys[failure["index"]]] for failure in e.details.get("writeErrors", [])})
+                error = e
+            except Exception as e:
+                self._requeue_rollups(rollups)
+                error = e
+        if error is not None:
+            raise error
+
+    def _requeue_logs(self, logs: List[dict]):
+        # Older entries first, still bounded by LOG_BUFFER_MAX
+        room = max(0, LOG_BUFFER_MAX - len(self.pending_logs))
+        self.dropped_logs += max(0, len(logs) - room)
+        self.pending_logs = logs[:room] + self.pending_logs
+
+    def _requeue_rollups(self, rollups: Dict[Tuple[datetime, str, int, str], int]):
+        for key, count in rollups.items():
+            self.rollups[key] += count
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(LOG_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing request logs: {e}")
+
+    async def start(self):
+        await ensure_log_storage()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing request logs: {e}")
+
+
+traffic_recorder = TrafficRecorder()
+
+
+async def traffic_stats(minutes: int, group_by: str, limit: int) -> dict:
+    """
+    Request counts over the last `minutes` minutes from the rollups, grouped
+    by one of ROLLUP_GROUPS. Reads at most one document per minute/path/status/IP.
+    """
+    since = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(minutes=minutes)
+    sort = {"_id": 1} if group_by == "minute" else {"count": -1}
+    pipeline = [
+        {"$match": {"minute": {"$gte": since}}},
+        {"$group": {"_id": f"${group_by}", "count": {"$sum": "$count"}}},
+        {"$sort": sort},
+        {"$facet": {
+            "groups": [{"$limit": limit}],
+            "total": [{"$group": {"_id": None, "count": {"$sum": "$count"}}}],
+        }},
+    ]
+    result = await rollup_collection.aggregate(pipeline).to_list(length=1)
+    facets = result[0] if result else {"groups": [], "total": []}
+    groups = [
+        {group_by: g["_id"].isoformat() if isinstance(g["_id"], datetime) else g["_id"], "count": g["count"]}
+        for g in facets["groups"]
+    ]
+    total = facets["total"][0]["count"] if facets["total"] else 0
+    return {"since": since.isoformat(), "total_requests": total, "group_by": group_by, "groups": groups}
+
 
 class LoggingMiddleware(BaseHTTPMiddleware):
     async def log_message(self, message: str):
         logger.info(message)
 
-    async def save_log_to_db(self, client_ip: str, path: str, status_code: int):
-        log_entry = {
-            "client_ip": client_ip,
-            "path": path,
-            "status_code": status_code,
-            "timestamp": datetime.now()
-        }
-        collection.insert_one(log_entry)
-
     async def dispatch(self, request: Request, call_next):
         client_ip = request.client.host
         path = request.url.path
-        
+
         # Log incoming request
         await self.log_message(f"Request from IP: {client_ip} to path: {path}")
 
@@ -41,7 +216,8 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         # Log outgoing response with status code
         await self.log_message(f"Response for {path} from IP: {client_ip} with status {response.status_code}")
 
-        # Save log to MongoDB
-        await self.save_log_to_db(client_ip, path, response.status_code)
-        
+        # Buffer the log; rollups group by route template so ids don't explode cardinality
+        route = request.scope.get("route")
+        traffic_recorder.record(client_ip, path, getattr(route, "path", path), response.status_code)
+
         return response
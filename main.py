@@ -1,25 +1,43 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, status, Query
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException, status, Query
 from pydantic import EmailStr
 from models import UserRegistrationModel 
 from models import BookReviewModel  
 import cloudinary # type: ignore
 import cloudinary.uploader # type: ignore
-from motor.motor_asyncio import AsyncIOMotorClient
 from fastapi.responses import HTMLResponse, JSONResponse
 import bcrypt  # type: ignore
+import asyncio
 import os
 from bson import ObjectId
 import psutil # type: ignore
 from welcomeEmail import send_email_via_gmail
 from dotenv import load_dotenv
-import redis.asyncio as redis  # type: ignore
-import json
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI, Request
 from starlette.middleware.base import BaseHTTPMiddleware
 import time
 from collections import defaultdict, deque
-from typing import Dict, Deque
-from logging_middleware import LoggingMiddleware
+from typing import Dict, Deque, Optional
+from logging_middleware import LoggingMiddleware, ROLLUP_GROUPS, ROLLUP_RETENTION_DAYS, traffic_recorder, traffic_stats
+from connections import mongo_client, redis_client
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError  # type: ignore
+from contextlib import asynccontextmanager
+import connections
+import image_processing
+from image_processing import upload_image
+from profiling import ProfilingMiddleware, admin_token_matches, profile_section
+from mongo_monitoring import MongoRouteMiddleware, mongo_stats
+from search_index import parse_rating, record_change, search_service
+from concurrency_limiter import ConcurrencyLimitMiddleware, concurrency_stats
+import sessions
+from recommendations import book_recs_key, book_key, get_recommendations, mark_dirty, user_recs_key
+import leaderboards
+from compression import (
+    PrecompressedPage,
+    cache_compressed_json,
+    compressed_json_response,
+    get_cached_response,
+    variant_response,
+)
 
 
 # Load environment variables from .env file
@@ -32,6 +50,21 @@ cloudinary.config(
     api_secret=os.getenv("CLOUDINARY_API_SECRET")
 )
 
+# Start and stop shared resources with the app
+@asynccontextmanager
+async def lifespan(app):
+    async with connections.lifespan(app):
+        await traffic_recorder.start()
+        await search_service.start(reviews_collection, r)
+        # First deploy: build the leaderboards from existing reviews in the background
+        leaderboards_task = asyncio.create_task(leaderboards.ensure_built(reviews_collection, r))
+        yield
+        leaderboards_task.cancel()
+        await search_service.stop()
+        await traffic_recorder.stop()
+        image_processing.shutdown_pool()
+
+
 # Initialize FastAPI
 app = FastAPI(
     title="ReviewVerse API 📚",
@@ -41,9 +74,73 @@ app = FastAPI(
         "name": "ReviewVerse Support",
         "email": "reviewverseone@gmail.com",
     },
+    lifespan=lifespan,
 )
 
 
+# Cache-Control header sent by each cacheable read route
+CACHE_CONTROL = {
+    "home": "public, max-age=3600",
+    "users": "public, max-age=60",
+    "reviews": "public, max-age=300",
+    "user": "private, no-cache",
+}
+
+
+# Static 429 page, compressed once at startup
+RATE_LIMIT_PAGE = PrecompressedPage("""
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Rate Limit Exceeded</title>
+        <style>
+            body {
+                display: flex;
+                justify-content: center;
+                align-items: center;
+                min-height: 100vh;
+                margin: 0;
+                background-color: #f4f4f4;
+                font-family: Arial, sans-serif;
+                text-align: center;
+                color: #333;
+            }
+            .container {
+                max-width: 500px;
+                background: #fff;
+                padding: 20px;
+                box-shadow: 0 4px 8px rgba(0, 0, 0, 0.2);
+                border-radius: 8px;
+            }
+            img {
+                max-width: 100%;
+                height: auto;
+                margin-bottom: 20px;
+                border-radius: 8px;
+            }
+            h1 {
+                font-size: 1.8rem;
+                margin-bottom: 10px;
+                color: #d9534f;
+            }
+            p {
+                font-size: 1rem;
+            }
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <img src="https://res.cloudinary.com/dpf5bkafv/image/upload/v1737006237/i5uzwnxn5gh2qz85kcyz.png" alt="Rate Limit Exceeded">
+            <h1>Rate Limit Exceeded</h1>
+            <p>You have made too many requests. Please try again after a minute.</p>
+        </div>
+    </body>
+    </html>
+""")
+
+
 # Rate Limmiting Middleware 1 minute 7 request
 class AdvancedMiddleware(BaseHTTPMiddleware):
     def __init__(self, app):
@@ -64,58 +161,7 @@ class AdvancedMiddleware(BaseHTTPMiddleware):
 
         # Check if the number of requests exceeds the limit
         if len(request_log) >= 7:  # Limit to 7 requests per minute
-            html_content = f"""
-            <!DOCTYPE html>
-            <html lang="en">
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>Rate Limit Exceeded</title>
-                <style>
-                    body {{
-                        display: flex;
-                        justify-content: center;
-                        align-items: center;
-                        min-height: 100vh;
-                        margin: 0;
-                        background-color: #f4f4f4;
-                        font-family: Arial, sans-serif;
-                        text-align: center;
-                        color: #333;
-                    }}
-                    .container {{
-                        max-width: 500px;
-                        background: #fff;
-                        padding: 20px;
-                        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.2);
-                        border-radius: 8px;
-                    }}
-                    img {{
-                        max-width: 100%;
-                        height: auto;
-                        margin-bottom: 20px;
-                        border-radius: 8px;
-                    }}
-                    h1 {{
-                        font-size: 1.8rem;
-                        margin-bottom: 10px;
-                        color: #d9534f;
-                    }}
-                    p {{
-                        font-size: 1rem;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <img src="https://res.cloudinary.com/dpf5bkafv/image/upload/v1737006237/i5uzwnxn5gh2qz85kcyz.png" alt="Rate Limit Exceeded">
-                    <h1>Rate Limit Exceeded</h1>
-                    <p>You have made too many requests. Please try again after a minute.</p>
-                </div>
-            </body>
-            </html>
-            """
-            return Response(content=html_content, media_type="text/html", status_code=429)
+            return RATE_LIMIT_PAGE.response(request, status_code=429)
 
         # Log the current request time
         request_log.append(current_time)
@@ -145,33 +191,30 @@ app.add_middleware(AdvancedMiddleware)
 # Add the logging middleware
 app.add_middleware(LoggingMiddleware)
 
-# Database setup (MongoDB with provided URI)
-client = AsyncIOMotorClient(os.getenv("MONGO_URI"))
+# Tag MongoDB commands with the route that issued them
+app.add_middleware(MongoRouteMiddleware)
+
+# Server-wide adaptive concurrency limit; sheds expensive routes first when overloaded
+app.add_middleware(ConcurrencyLimitMiddleware)
+
+# Sampled request profiling (outermost, so it sees the time spent in every middleware)
+app.add_middleware(ProfilingMiddleware)
+
+# Database setup (shared MongoDB client from the connection layer)
+client = mongo_client
 db = client['reviewverse_db']
 
 # MongoDB collections
 users_collection = db["users"]
 reviews_collection = db["reviews"]
 
-# Get Redis connection details from environment variables
-redis_host = os.getenv("REDIS_HOST")
-redis_port = os.getenv("REDIS_PORT")
-redis_password = os.getenv("REDIS_PASSWORD")
-redis_ssl = os.getenv("REDIS_SSL") == "True"
-
-# Redis connection setup
-r = redis.Redis(
-    host=redis_host,
-    port=redis_port,
-    password=redis_password,
-    ssl=redis_ssl,
-)
+# Redis connection (shared pool from the connection layer)
+r = redis_client
 
 
 
-@app.get("/", response_class=HTMLResponse)
-async def home():
-    return """
+# Static home page, compressed once at startup
+HOME_PAGE = PrecompressedPage("""
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -247,7 +290,12 @@ async def home():
         </div>
     </body>
     </html>
-    """
+    """)
+
+
+@app.get("/", response_class=HTMLResponse)
+async def home(request: Request):
+    return HOME_PAGE.response(request, cache_control=CACHE_CONTROL["home"])
 
 
 # Endpoint to register a user
@@ -285,12 +333,12 @@ async def register_user(
         )
     
     try:
-        # Upload profile photo to Cloudinary in 'reviewregister' folder
-        upload_result = cloudinary.uploader.upload(profilephoto.file, folder="reviewregister")
-        photo_url = upload_result['secure_url']
+        # Upload profile photo to Cloudinary in 'reviewregister' folder (downscaled, deduplicated by hash)
+        photo_url = await upload_image(profilephoto, folder="reviewregister")
         
         # Hash the password before storing it
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        with profile_section("bcrypt"):
+            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
 
         # Create a user object with the data (using UserRegistrationModel)
         user_data = UserRegistrationModel(
@@ -314,11 +362,25 @@ async def register_user(
 
         return JSONResponse(content={"message": "User registered successfully", "user": user_data_dict})
 
+    except HTTPException:
+        raise
     except Exception as e:
         # Handle potential errors, e.g., file upload failure, database insertion failure
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
+# Cached /users list; it repeats every user's profile fields
+USERS_LIST_CACHE_KEY = "users_list_compressed"
+
+
+async def invalidate_user_cache(user_id: str):
+    try:
+        # The list holds the same fields, so drop it too or its ETag keeps answering 304
+        await r.delete(user_cache_key(user_id), USERS_LIST_CACHE_KEY)
+    except Exception as e:
+        print(f"Error invalidating user cache: {e}")
+
+
 # Endpoint to update user details by ID
 @app.put("/update/{user_id}")
 async def update_user(user_id: str, username: str = Form(...), gender: str = Form(...), age: int = Form(...), currentrole: str = Form(...)):
@@ -347,6 +409,13 @@ async def update_user(user_id: str, username: str = Form(...), gender: str = For
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    # Drop the cached user details so the next read gets a new ETag
+    await invalidate_user_cache(user_id)
+    try:
+        await sessions.update_user_sessions(r, user_id, {"username": username, "gender": gender, "age": age, "currentrole": currentrole})
+    except Exception as e:
+        print(f"Error updating user sessions: {e}")
+    
     return JSONResponse(content={"message": "User details updated successfully"})
 
 # Endpoint to delete user by ID
@@ -357,23 +426,30 @@ async def delete_user(user_id: str):
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    await invalidate_user_cache(user_id)
+    try:
+        await sessions.revoke_user_sessions(r, user_id)
+    except Exception as e:
+        print(f"Error revoking user sessions: {e}")
+    
     return JSONResponse(content={"message": "User deleted successfully"})
 
 # Endpoint to get all registered users' basic details
 @app.get("/users")
-async def get_users():
+async def get_users(request: Request):
     """
     Fetch the list of users from MongoDB with Redis caching.
+    The cached response is stored already compressed (gzip and brotli)
+    together with its ETag, so conditional requests are answered from Redis.
     """
-    cache_key = "users_list"
+    cache_key = USERS_LIST_CACHE_KEY
     
     # Check if data exists in Redis
     try:
-        cached_users = await r.get(cache_key)
-        if cached_users:
-            print(f"Cache hit for users: {cached_users}")
-            users = json.loads(cached_users)
-            return JSONResponse(content={"users": users})
+        cached_response = await get_cached_response(r, cache_key, request, CACHE_CONTROL["users"])
+        if cached_response:
+            print("Cache hit for users")
+            return cached_response
     except Exception as e:
         print(f"Error fetching from Redis: {e}")
     
@@ -381,13 +457,13 @@ async def get_users():
     try:
         users_cursor = users_collection.find({}, {"_id": 0, "username": 1, "gender": 1, "age": 1, "currentrole": 1})
         users = await users_cursor.to_list(length=None)
-        print(f"Fetched users from MongoDB: {users}")
+        print(f"Fetched users from MongoDB: {len(users)} users")
         
-        # Cache the result in Redis with a TTL (e.g., 600 seconds = 10 minutes)
-        await r.setex(cache_key, 600, json.dumps(users))  # Await Redis setex command
+        # Cache the compressed response in Redis with a TTL (e.g., 600 seconds = 10 minutes)
+        variants = await cache_compressed_json(r, cache_key, 600, {"users": users})
         print("Data saved in Redis successfully..")
         
-        return JSONResponse(content={"users": users})
+        return variant_response(request, variants, cache_control=CACHE_CONTROL["users"])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching users: {e}")
 
@@ -398,9 +474,13 @@ async def get_users():
 def str_objectid(id: ObjectId) -> str:
     return str(id)
 
+def user_cache_key(user_id: str) -> str:
+    return f"user_{user_id}_compressed"
+
+
 # Endpoint to get user details by ID
 @app.get("/user/{id}")
-async def get_user_by_id(id: str):
+async def get_user_by_id(id: str, request: Request):
     # Convert the id from string to ObjectId
     try:
         user_id = ObjectId(id)
@@ -410,6 +490,15 @@ async def get_user_by_id(id: str):
             detail="Invalid user ID format."
         )
     
+    # Serve from cache (or answer 304) without touching MongoDB
+    cache_key = user_cache_key(id)
+    try:
+        cached_response = await get_cached_response(r, cache_key, request, CACHE_CONTROL["user"])
+        if cached_response:
+            return cached_response
+    except Exception as e:
+        print(f"Error fetching from Redis: {e}")
+    
     # Fetch the user from the database
     user = await users_collection.find_one({"_id": user_id})
     
@@ -428,8 +517,15 @@ async def get_user_by_id(id: str):
         "currentrole": user["currentrole"],
         "profilephoto": user["profilephoto"]
     }
+    content = {"message": "User details retrieved successfully", "user": user_details}
 
-    return JSONResponse(content={"message": "User details retrieved successfully", "user": user_details})
+    # Cache the compressed response with its ETag for 10 minutes
+    try:
+        variants = await cache_compressed_json(r, cache_key, 600, content)
+        return variant_response(request, variants, cache_control=CACHE_CONTROL["user"])
+    except Exception as e:
+        print(f"Error saving to Redis: {e}")
+        return compressed_json_response(request, content, cache_control=CACHE_CONTROL["user"])
 
 
 # Endpoint to login a user
@@ -450,13 +546,22 @@ async def login_user(
     
     # Compare the provided password with the stored hashed password
     stored_password = user["password"]
-    if not bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('utf-8')):
+    with profile_section("bcrypt"):
+        password_matches = bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('utf-8'))
+    if not password_matches:
         # If the passwords do not match, return an error
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid credentials. Incorrect password."
         )
     
+    # Start a session so later calls can send a token instead of repeating this check
+    token = None
+    try:
+        token = await sessions.create_session(r, user)
+    except Exception as e:
+        print(f"Error creating session: {e}")
+
     # If the user exists and the password matches, return success
     return JSONResponse(
         content={"message": "User logged in successfully", "user": {
@@ -466,9 +571,57 @@ async def login_user(
             "gender": user["gender"],
             "age": user["age"],
             "currentrole": user["currentrole"]
-        }}
+        }, "token": token, "token_type": "bearer", "expires_in": sessions.SESSION_TTL}
     )
 
+
+async def session_user(authorization: Optional[str]) -> Optional[dict]:
+    """
+    The logged-in user for an "Authorization: Bearer <token>" header, read from
+    Redis. None when the request has no token.
+    """
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authorization header. Use 'Bearer <token>'.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    try:
+        user = await sessions.get_session_user(r, token.strip())
+    except (RedisConnectionError, RedisTimeoutError) as e:
+        print(f"Error reading session: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Sessions are unavailable, please try again")
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Session expired or invalid. Please log in again.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+
+def check_session_owner(user: Optional[dict], user_id: str):
+    # A session may only act for its own user
+    if user is not None and user["id"] != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Session does not belong to this user")
+
+
+# Endpoint to end a session
+@app.post("/logout")
+async def logout_user(authorization: Optional[str] = Header(None)):
+    if not authorization:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not logged in. Send 'Authorization: Bearer <token>'.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    await session_user(authorization)
+    await sessions.end_session(r, authorization.partition(" ")[2].strip())
+    return JSONResponse(content={"message": "User logged out successfully"})
+
 # Add book review endpoint
 @app.post("/add-review")
 async def add_review(
@@ -480,7 +633,8 @@ async def add_review(
     rating: float = Form(...),  # Rating is required
     buyplace: str = Form(...),  # Buy place is required
     satisfied: bool = Form(...),  # Satisfaction status is required
-    user_id: str = Form(...)  # User ID is required
+    user_id: str = Form(None),  # User ID is required without a session token
+    authorization: Optional[str] = Header(None)  # "Bearer <token>" from /login
 ):
     # Validate the reading status and buy place
     valid_reading_status = ['start', 'continue', 'finished']
@@ -504,20 +658,30 @@ async def add_review(
             detail="Rating must be between 0 and 5"
         )
 
-    # Check if the user exists
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
+    # A session already names an existing user; without one, check the user_id
+    user = await session_user(authorization)
+    if user is not None:
+        if user_id:
+            check_session_owner(user, user_id)
+        user_id = user["id"]
+    else:
+        if not user_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="user_id or a session token is required"
+            )
+        user = await users_collection.find_one({"_id": ObjectId(user_id)})
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
 
     try:
         # Optional: Upload the book photo to Cloudinary
         photo_url = None
         if bookphoto:
-            upload_result = cloudinary.uploader.upload(bookphoto.file, folder="bookreviews")
-            photo_url = upload_result['secure_url']
+            photo_url = await upload_image(bookphoto, folder="bookreviews")
 
         # Create a book review object with the data (using BookReviewModel)
         review_data = BookReviewModel(
@@ -539,15 +703,26 @@ async def add_review(
         # Return the inserted review data with the new ID
         review_dict["_id"] = str(result.inserted_id)
 
+        # Queue the book for the next incremental recommendations refresh
+        await mark_dirty(r, user_id, (bookname, bookauthor))
+
+        # Update the leaderboards; use the same creation time that update and delete subtract
+        await leaderboards.record_review(r, review_dict, created=result.inserted_id.generation_time.timestamp())
+
+        # Index the review for search
+        await record_change(r, review_dict["_id"])
+
         return JSONResponse(content={"message": "Book review added successfully", "review": review_dict})
 
+    except HTTPException:
+        raise
     except Exception as e:
         # Catch any exception and return it as a response to the user
         return HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
 @app.get("/get-reviews/{user_id}")
-async def get_reviews(user_id: str):
+async def get_reviews(user_id: str, request: Request):
     # Fetch all reviews associated with the provided user_id
     reviews = await reviews_collection.find({"user_id": user_id}).to_list(length=None)
     if not reviews:
@@ -560,25 +735,22 @@ async def get_reviews(user_id: str):
     for review in reviews:
         review["_id"] = str(review["_id"])
     
-    return JSONResponse(content={"message": "Reviews fetched successfully", "reviews": reviews})
+    return compressed_json_response(request, {"message": "Reviews fetched successfully", "reviews": reviews})
 
 
 @app.get("/get-reviews")
-async def get_reviews(page: int = 1, limit: int = 10):
+async def get_reviews(request: Request, page: int = 1, limit: int = 10):
     """
     Fetch reviews from MongoDB with Redis caching.
-    Reviews are cached for 12 hours (43200 seconds).
+    Reviews are cached for 12 hours (43200 seconds), already compressed.
     """
     # Define cache key based on page and limit to store reviews
-    cache_key = f"reviews_page_{page}_limit_{limit}"
+    cache_key = f"reviews_page_{page}_limit_{limit}_compressed"
 
-    # Check if reviews are cached in Redis
-    cached_reviews = await r.get(cache_key)  # This should be awaited in async context
-    
-    # Redis returns bytes, so we need to decode it into a string
-    if cached_reviews:
-        reviews = json.loads(cached_reviews.decode("utf-8"))
-        return JSONResponse(content={"message": "Reviews fetched from cache", "reviews": reviews})
+    # Serve the cached, precompressed response (or a 304) if there is one
+    cached_response = await get_cached_response(r, cache_key, request, CACHE_CONTROL["reviews"])
+    if cached_response:
+        return cached_response
 
     # If not cached, fetch from MongoDB
     skip = (page - 1) * limit
@@ -595,10 +767,15 @@ async def get_reviews(page: int = 1, limit: int = 10):
     for review in reviews:
         review["_id"] = str(review["_id"])
 
-    # Cache the reviews in Redis with a TTL of 12 hours (43200 seconds)
-    await r.setex(cache_key, 43200, json.dumps(reviews))  # Using async setex
-
-    return JSONResponse(content={"message": "Reviews fetched successfully", "reviews": reviews})
+    # Cache the reviews in Redis with a TTL of 12 hours (43200 seconds); serve the
+    # same variants so this response's ETag matches the cached one
+    content = {"message": "Reviews fetched successfully", "reviews": reviews}
+    try:
+        variants = await cache_compressed_json(r, cache_key, 43200, content)
+        return variant_response(request, variants, cache_control=CACHE_CONTROL["reviews"])
+    except Exception as e:
+        print(f"Error saving to Redis: {e}")
+        return compressed_json_response(request, content, cache_control=CACHE_CONTROL["reviews"])
 
 
 
@@ -613,8 +790,11 @@ async def update_review(
     readingstatus: str = Form(None),  # Reading status is optional for update
     rating: float = Form(None),  # Rating is optional for update
     buyplace: str = Form(None),  # Buy place is optional for update
-    satisfied: bool = Form(None)  # Satisfaction status is optional for update
+    satisfied: bool = Form(None),  # Satisfaction status is optional for update
+    authorization: Optional[str] = Header(None)  # Optional "Bearer <token>" from /login
 ):
+    check_session_owner(await session_user(authorization), user_id)
+
     # Check if the review exists
     review = await reviews_collection.find_one({"_id": ObjectId(review_id), "user_id": user_id})
     if not review:
@@ -648,8 +828,7 @@ async def update_review(
         # Optional: Upload the book photo to Cloudinary
         photo_url = review.get('bookphoto')  # Keep the existing photo if no new one is provided
         if bookphoto:
-            upload_result = cloudinary.uploader.upload(bookphoto.file, folder="bookreviews")
-            photo_url = upload_result['secure_url']
+            photo_url = await upload_image(bookphoto, folder="bookreviews")
 
         # Update the review data
         update_data = {}
@@ -679,16 +858,36 @@ async def update_review(
         if result.matched_count == 0:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Review not found")
 
+        # Move the review's leaderboard contribution if its book or rating changed
+        updated_review = {**review, **update_data}
+        if any(updated_review.get(field) != review.get(field) for field in ("bookname", "bookauthor", "rating")):
+            created = review["_id"].generation_time.timestamp()
+            await leaderboards.remove_review(r, review, created)
+            await leaderboards.record_review(r, updated_review, created)
+
+        # The review may have moved to a different book, so mark both
+        await mark_dirty(
+            r, user_id,
+            (review.get("bookname"), review.get("bookauthor")),
+            (update_data.get("bookname", review.get("bookname")), update_data.get("bookauthor", review.get("bookauthor"))),
+        )
+        await record_change(r, review_id)
+
         return JSONResponse(content={"message": "Review updated successfully"})
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 @app.delete("/delete-review/{user_id}/{review_id}")
 async def delete_review(
     user_id: str,
-    review_id: str
+    review_id: str,
+    authorization: Optional[str] = Header(None)  # Optional "Bearer <token>" from /login
 ):
+    check_session_owner(await session_user(authorization), user_id)
+
     # Check if the review exists
     review = await reviews_collection.find_one({"_id": ObjectId(review_id), "user_id": user_id})
     if not review:
@@ -704,6 +903,10 @@ async def delete_review(
         if result.deleted_count == 0:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Review not found")
 
+        await mark_dirty(r, user_id, (review.get("bookname"), review.get("bookauthor")))
+        await leaderboards.remove_review(r, review, review["_id"].generation_time.timestamp())
+        await record_change(r, review_id)
+
         return JSONResponse(content={"message": "Review deleted successfully"})
 
     except Exception as e:
@@ -713,6 +916,7 @@ async def delete_review(
 
 @app.get("/filter", response_model=dict)
 async def filter_reviews(
+    request: Request,
     bookname: str = Query(None),
     bookauthor: str = Query(None),
     readingstatus: str = Query(None),
@@ -766,19 +970,176 @@ async def filter_reviews(
         ]
         total_reviews = await reviews_collection.count_documents(filter_query)
 
-        return {
+        return compressed_json_response(request, {
             "message": "Filtered reviews fetched successfully.",
             "total": total_reviews,
             "page": page,
             "page_size": page_size,
             "reviews": reviews,
-        }
+        })
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+
+
+# Ranked full-text search over review text, book names and authors
+@app.get("/search")
+async def search_reviews(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    bookname: str = Query(None),
+    bookauthor: str = Query(None),
+    readingstatus: str = Query(None),
+    rating: str = Query(None),
+    buyplace: str = Query(None),
+    satisfied: bool = Query(None),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(10, ge=1, le=100),
+):
+    index = search_service.index
+    if index is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Search index is still being built. Please try again shortly.",
+            headers={"Retry-After": "5"},
+        )
+    if readingstatus and readingstatus not in ["start", "continue", "finished"]:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid reading status. Choose from 'start', 'continue', or 'finished'.",
+        )
+    if buyplace and buyplace not in ["online", "offline"]:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid buy place. Choose from 'online' or 'offline'.",
+        )
+    try:
+        rating_filter = parse_rating(rating) if rating else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid rating. Use a number, optionally prefixed with >, <, >= or <=.")
+
+    try:
+        # Ranking is CPU work; keep it off the event loop
+        total, hits = await asyncio.to_thread(
+            index.search,
+            q, offset=(page - 1) * page_size, limit=page_size,
+            bookname=bookname, bookauthor=bookauthor, readingstatus=readingstatus,
+            rating=rating_filter, buyplace=buyplace, satisfied=satisfied,
+        )
+
+        # Only the returned page is loaded from MongoDB, in score order
+        ids = [review_id for review_id, _ in hits]
+        found = {review["_id"]: review for review in await reviews_collection.find({"_id": {"$in": ids}}).to_list(length=len(ids))}
+        reviews = [
+            {**found[review_id], "_id": str(review_id), "score": score}
+            for review_id, score in hits if review_id in found
+        ]
+
+        return compressed_json_response(request, {
+            "message": "Search results fetched successfully.",
+            "query": q,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "reviews": reviews,
+        })
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+
+
+# Personalized recommendations, precomputed by recommendations_job.py
+@app.get("/recommendations/user/{user_id}")
+async def get_user_recommendations(user_id: str):
+    recommendations = await get_recommendations(r, user_recs_key(user_id))
+    if recommendations is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No recommendations available for this user yet"
+        )
+    return JSONResponse(content={"message": "Recommendations fetched successfully", "recommendations": recommendations})
+
+
+# Books similar to a given book, precomputed by recommendations_job.py
+@app.get("/recommendations/book")
+async def get_similar_books(bookname: str = Query(...), bookauthor: str = Query(...)):
+    recommendations = await get_recommendations(r, book_recs_key(book_key(bookname, bookauthor)))
+    if recommendations is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No recommendations available for this book yet"
+        )
+    return JSONResponse(content={"message": "Similar books fetched successfully", "recommendations": recommendations})
+
+
 
+# Book leaderboards kept in Redis sorted sets
+LEADERBOARDS = {
+    "top-rated": leaderboards.TOP_RATED_KEY,
+    "most-reviewed": leaderboards.MOST_REVIEWED_KEY,
+    "trending": leaderboards.TRENDING_KEY,
+}
+
+
+@app.get("/leaderboards/{board}")
+async def get_leaderboard(board: str, limit: int = Query(10, ge=1, le=100)):
+    if board not in LEADERBOARDS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Unknown leaderboard. Choose from 'top-rated', 'most-reviewed', or 'trending'"
+        )
+    books = await leaderboards.top_books(r, LEADERBOARDS[board], limit)
+    return JSONResponse(content={"message": "Leaderboard fetched successfully", "board": board, "books": books})
+
+
+
+def require_admin_token(token: Optional[str]):
+    # Operational endpoints expose client IPs and query shapes; they need the admin token.
+    # It is sent in X-Admin-Token, not X-Profile-Token, so polling them does not force a profile
+    if not admin_token_matches(token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin token required. Send it in the X-Admin-Token header."
+        )
+
+
+# Request counts from the per-minute traffic rollups
+@app.get("/traffic-stats")
+async def get_traffic_stats(
+    minutes: int = Query(60, ge=1, le=ROLLUP_RETENTION_DAYS * 24 * 60),
+    group_by: str = Query("path"),
+    limit: int = Query(20, ge=1, le=1000),
+    x_admin_token: Optional[str] = Header(None),
+):
+    require_admin_token(x_admin_token)
+    if group_by not in ROLLUP_GROUPS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid group_by. Choose from 'path', 'status_code', 'client_ip', or 'minute'"
+        )
+    try:
+        stats = await traffic_stats(minutes, group_by, limit)
+        return JSONResponse(content={"message": "Traffic stats fetched successfully", **stats})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
 
+# Per-route MongoDB call counts and time, and the slowest recent queries
+@app.get("/mongo-stats")
+async def get_mongo_stats(limit: int = Query(50, ge=0, le=1000), x_admin_token: Optional[str] = Header(None)):
+    require_admin_token(x_admin_token)
+    return JSONResponse(content={"message": "MongoDB stats fetched successfully", **mongo_stats(limit)})
+
+
+# Current adaptive concurrency limit and per-priority shed counts
+@app.get("/concurrency-stats")
+async def get_concurrency_stats():
+    return JSONResponse(content={"message": "Concurrency stats fetched successfully", **concurrency_stats()})
+
+
 # System Health
 @app.get("/health")
 async def health_status():
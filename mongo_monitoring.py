@@ -0,0 +1,220 @@
+"""
+MongoDB command monitoring.
+
+Every command sent by the shared Motor client is timed and attributed to
+the API route that issued it (through a request context variable), so the
+per-route counters show how many Mongo calls each request makes and how
+long they take. Commands slower than MONGO_SLOW_QUERY_MS go to an
+in-memory slow-query log with the shape of their filter.
+
+Counters are per worker process and reset on restart.
+"""
+import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+from typing import Dict, Optional
+from pymongo import monitoring
+
+# Commands at least this slow are kept in the slow-query log
+MONGO_SLOW_QUERY_MS = float(os.getenv("MONGO_SLOW_QUERY_MS", "100"))
+
+# Number of slow queries kept, oldest are dropped first
+MONGO_SLOW_LOG_SIZE = int(os.getenv("MONGO_SLOW_LOG_SIZE", "200"))
+
+# Commands issued outside a request (startup, background flushes)
+BACKGROUND_ROUTE = "<background>"
+UNMATCHED_ROUTE = "<unmatched>"
+
+IGNORED_COMMANDS = {"ping", "hello", "ismaster", "isMaster", "endSessions", "buildInfo"}
+
+# Filter fields to show in the slow-query log, per command
+FILTER_FIELDS = {
+    "find": ("filter", "sort"),
+    "aggregate": ("pipeline",),
+    "count": ("query",),
+    "distinct": ("query",),
+    "findAndModify": ("query", "sort"),
+}
+
+# ASGI scope of the request being handled; the route is read from it when a
+# command runs, after the router has matched the request
+_current_scope: ContextVar[Optional[dict]] = ContextVar("mongo_request_scope", default=None)
+
+
+def route_of(scope: Optional[dict]) -> str:
+    if scope is None:
+        return BACKGROUND_ROUTE
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+def query_shape(value):
+    """
+    A filter with every value replaced by "?", so slow-query entries show
+    which fields were queried without logging user data.
+    """
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [query_shape(value[0])] if value else []
+    return "?"
+
+
+def _command_shape(command_name: str, command: dict):
+    if command_name in FILTER_FIELDS:
+        return {field: query_shape(command[field]) for field in FILTER_FIELDS[command_name] if field in command}
+    for field, key in (("updates", "q"), ("deletes", "q")):
+        statements = command.get(field)
+        if statements:
+            return {field: len(statements), key: query_shape(statements[0].get(key, {}))}
+    return None
+
+
+def _documents(reply: dict) -> int:
+    # Documents returned by reads, matched by writes
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if "n" in reply:
+        return int(reply["n"])
+    if "values" in reply:
+        return len(reply["values"])
+    return 0
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.calls = 0
+        self.time_ms = 0.0
+        self.max_ms = 0.0
+        self.documents = 0
+        self.commands: Counter = Counter()
+
+    def to_dict(self, route: str) -> dict:
+        requests = self.requests
+        return {
+            "route": route,
+            "requests": requests,
+            "mongo_calls": self.calls,
+            "mongo_time_ms": round(self.time_ms, 2),
+            "calls_per_request": round(self.calls / requests, 2) if requests else None,
+            "time_per_request_ms": round(self.time_ms / requests, 2) if requests else None,
+            "max_call_ms": round(self.max_ms, 2),
+            "documents": self.documents,
+            "commands": dict(self.commands),
+        }
+
+
+class MongoCommandMonitor(monitoring.CommandListener):
+    """
+    pymongo command listener. Motor runs commands on worker threads with a
+    copy of the request's context, so the route context variable is visible here.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight: Dict[tuple, tuple] = {}
+        self.routes: Dict[str, RouteStats] = defaultdict(RouteStats)
+        self.slow_queries: deque = deque(maxlen=MONGO_SLOW_LOG_SIZE)
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        details = (
+            _current_scope.get(),
+            collection if isinstance(collection, str) else None,
+            _command_shape(event.command_name, event.command),
+        )
+        with self.lock:
+            self.in_flight[(event.request_id, event.connection_id)] = details
+
+    def succeeded(self, event):
+        self._finish(event, _documents(event.reply), None)
+
+    def failed(self, event):
+        self._finish(event, 0, str(event.failure.get("errmsg", "")) if isinstance(event.failure, dict) else str(event.failure))
+
+    def _finish(self, event, documents: int, error: Optional[str]):
+        with self.lock:
+            details = self.in_flight.pop((event.request_id, event.connection_id), None)
+        if details is None:
+            return
+        scope, collection, shape = details
+        route = route_of(scope)
+        duration_ms = event.duration_micros / 1000
+
+        with self.lock:
+            stats = self.routes[route]
+            stats.calls += 1
+            stats.time_ms += duration_ms
+            stats.max_ms = max(stats.max_ms, duration_ms)
+            stats.documents += documents
+            stats.commands[f"{event.command_name} {collection}" if collection else event.command_name] += 1
+
+        if duration_ms >= MONGO_SLOW_QUERY_MS:
+            entry = {
+                "timestamp": time.time(),
+                "route": route,
+                "method": scope.get("method") if scope else None,
+                "database": event.database_name,
+                "collection": collection,
+                "command": event.command_name,
+                "duration_ms": round(duration_ms, 2),
+                "documents": documents,
+                "shape": shape,
+            }
+            if error:
+                entry["error"] = error
+            with self.lock:
+                self.slow_queries.append(entry)
+            print(f"Slow MongoDB {event.command_name} on {collection} from {route}: {duration_ms:.1f}ms, {documents} documents")
+
+    def request_finished(self, scope: dict):
+        with self.lock:
+            self.routes[route_of(scope)].requests += 1
+
+    def stats(self, limit: int) -> dict:
+        with self.lock:
+            routes = [stats.to_dict(route) for route, stats in self.routes.items()]
+            slow = list(self.slow_queries)
+        routes.sort(key=lambda item: item["mongo_time_ms"], reverse=True)
+        return {
+            "slow_query_threshold_ms": MONGO_SLOW_QUERY_MS,
+            "routes": routes,
+            "slow_queries": list(reversed(slow))[:limit],
+        }
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+            self.slow_queries.clear()
+
+
+command_monitor = MongoCommandMonitor()
+
+
+class MongoRouteMiddleware:
+    """
+    Plain ASGI middleware that tags Mongo commands with the request they came from.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_scope.reset(token)
+            command_monitor.request_finished(scope)
+
+
+def mongo_stats(limit: int = 50) -> dict:
+    return command_monitor.stats(limit)
+
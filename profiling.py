@@ -0,0 +1,348 @@
+"""
+Opt-in sampled request profiling.
+
+A profiled request gets:
+- a stack sampler on the event loop thread, for a flame graph of where CPU time goes
+- wall time spent in MongoDB, Redis, Cloudinary, bcrypt and JSON serialization
+  (also sent back in a Server-Timing header)
+
+Each profile is written to PROFILE_DIR as a speedscope file (open it at
+https://www.speedscope.app) or as collapsed stacks for flamegraph.pl.
+
+Requests are picked at random at PROFILE_SAMPLE_RATE when PROFILE_ENABLED is
+set, or on demand by sending "X-Profile-Token: <PROFILE_ADMIN_TOKEN>".
+When neither is configured the middleware passes requests straight through.
+"""
+import asyncio
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from pymongo import monitoring
+from redis.asyncio.connection import Connection, SSLConnection  # type: ignore
+
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED") == "True"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+
+# Comma-separated path prefixes eligible for random sampling, e.g. "/filter,/register" (empty means all)
+PROFILE_PATHS = tuple(p.strip() for p in os.getenv("PROFILE_PATHS", "").split(",") if p.strip())
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_FORMAT = os.getenv("PROFILE_FORMAT", "speedscope")  # "speedscope" or "collapsed"
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# Profile files kept in PROFILE_DIR; the oldest are deleted as new ones are written
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "500"))
+PROFILE_SUFFIXES = (".speedscope.json", ".collapsed")
+
+PROFILE_HEADER = b"x-profile-token"
+CATEGORIES = ("mongo", "redis", "cloudinary", "bcrypt", "serialization")
+
+# The profile of the request being handled, None when it is not profiled
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, thread_id: int):
+        self.method = method
+        self.path = path
+        self.route = path
+        self.thread_id = thread_id
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.status_code = None
+        self.timings: Dict[str, float] = defaultdict(float)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.samples: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, category: str, seconds: float, calls: int = 1):
+        # Mongo events arrive on driver threads, so guard the counters
+        with self.lock:
+            self.timings[category] += seconds
+            self.calls[category] += calls
+
+    def server_timing(self) -> str:
+        elapsed = self.elapsed or time.perf_counter() - self.started
+        parts = [f"{category};dur={self.timings[category] * 1000:.1f}" for category in CATEGORIES if category in self.timings]
+        parts.append(f"total;dur={elapsed * 1000:.1f}")
+        return ", ".join(parts)
+
+    def summary(self) -> str:
+        parts = [f"{category}={self.timings[category] * 1000:.1f}ms/{self.calls[category]}" for category in CATEGORIES if category in self.timings]
+        return f"{self.method} {self.path} {self.status_code} in {self.elapsed * 1000:.1f}ms ({', '.join(parts) or 'no I/O'})"
+
+    def _file_stem(self) -> str:
+        route = re.sub(r"[^A-Za-z0-9]+", "_", self.route).strip("_") or "root"
+        return f"{time.strftime('%Y%m%dT%H%M%S')}-{self.method.lower()}-{route}-{uuid.uuid4().hex[:8]}"
+
+    def write(self, directory: str, fmt: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(directory, self._file_stem())
+        if fmt == "collapsed":
+            with open(f"{stem}.collapsed", "w") as f:
+                for stack, count in self.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            # Dependency wall time in microseconds, one line per category
+            with open(f"{stem}.timings.collapsed", "w") as f:
+                for category, seconds in self.timings.items():
+                    f.write(f"{self.route};{category} {int(seconds * 1_000_000)}\n")
+            return f"{stem}.collapsed"
+
+        path = f"{stem}.speedscope.json"
+        with open(path, "w") as f:
+            json.dump(self._speedscope(), f)
+        return path
+
+    def _speedscope(self) -> dict:
+        frames: List[dict] = []
+        index: Dict[str, int] = {}
+
+        def frame_id(name: str) -> int:
+            if name not in index:
+                index[name] = len(frames)
+                frames.append({"name": name})
+            return index[name]
+
+        interval = PROFILE_INTERVAL_MS
+        stacks = [([frame_id(frame) for frame in stack.split(";")], count * interval) for stack, count in self.samples.items()]
+        dependencies = [([frame_id(self.route), frame_id(category)], seconds * 1000) for category, seconds in self.timings.items()]
+        elapsed_ms = self.elapsed * 1000
+
+        def profile(name: str, entries) -> dict:
+            return {
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": max(elapsed_ms, sum(weight for _, weight in entries)),
+                "samples": [sample for sample, _ in entries],
+                "weights": [weight for _, weight in entries],
+            }
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.method} {self.path}",
+            "exporter": "reviewverse-profiling",
+            "shared": {"frames": frames},
+            "profiles": [
+                profile(f"{self.method} {self.route} event loop samples", stacks),
+                profile(f"{self.method} {self.route} wall time by dependency", dependencies),
+            ],
+        }
+
+
+def prune_profiles(directory: str, max_files: int):
+    """
+    Delete the oldest profile files so at most max_files remain.
+    """
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith(PROFILE_SUFFIXES)]
+    except FileNotFoundError:
+        return
+    if len(entries) <= max_files:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - max_files]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass  # Another worker pruned it first
+
+
+@contextmanager
+def profile_section(category: str):
+    """
+    Attribute the wall time of a block to a category on the current profile.
+    Does nothing beyond a context variable lookup when the request is not profiled.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(category, time.perf_counter() - start)
+
+
+def _collapse(frame) -> Optional[str]:
+    # The loop waiting in select() is idle; that time shows up under the I/O categories
+    if frame is None or frame.f_code.co_filename.endswith("selectors.py"):
+        return None
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ","))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """
+    One background thread per process that samples the event loop thread's
+    stack while any profiled request is in flight. Requests served
+    concurrently with a profiled one also appear in its samples.
+    """
+    def __init__(self, interval_ms: float):
+        self.interval = interval_ms / 1000
+        self.lock = threading.Lock()
+        self.profiles = set()
+        self.thread = None
+
+    def add(self, profile: RequestProfile):
+        with self.lock:
+            self.profiles.add(profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="profile-sampler", daemon=True)
+                self.thread.start()
+
+    def remove(self, profile: RequestProfile):
+        with self.lock:
+            self.profiles.discard(profile)
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.profiles:
+                    self.thread = None
+                    return
+                profiles = list(self.profiles)
+            frames = sys._current_frames()
+            stacks = {}
+            for profile in profiles:
+                if profile.thread_id not in stacks:
+                    stacks[profile.thread_id] = _collapse(frames.get(profile.thread_id))
+                stack = stacks[profile.thread_id]
+                if stack:
+                    profile.samples[stack] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+sampler = StackSampler(PROFILE_INTERVAL_MS)
+
+
+def admin_token_matches(value) -> bool:
+    """
+    Whether an X-Profile-Token header value is the admin token. Always False
+    when PROFILE_ADMIN_TOKEN is not set.
+    """
+    if not PROFILE_ADMIN_TOKEN or value is None:
+        return False
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return hmac.compare_digest(value, PROFILE_ADMIN_TOKEN.encode("utf-8"))
+
+
+def should_profile(scope) -> bool:
+    if PROFILE_ADMIN_TOKEN:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return admin_token_matches(value)
+    if not PROFILE_ENABLED:
+        return False
+    if PROFILE_PATHS and not scope["path"].startswith(PROFILE_PATHS):
+        return False
+    return random.random() < PROFILE_SAMPLE_RATE
+
+
+class ProfilingMiddleware:
+    """
+    Plain ASGI middleware, so unprofiled requests pay for one function call.
+    Add it last so it wraps every other middleware.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.active = PROFILE_ENABLED or bool(PROFILE_ADMIN_TOKEN)
+
+    async def __call__(self, scope, receive, send):
+        if not self.active or scope["type"] != "http" or not should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], threading.get_ident())
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", profile.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = _current_profile.set(profile)
+        sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            sampler.remove(profile)
+            _current_profile.reset(token)
+            profile.elapsed = time.perf_counter() - profile.started
+            profile.route = getattr(scope.get("route"), "path", profile.path)
+            try:
+                path = await asyncio.to_thread(profile.write, PROFILE_DIR, PROFILE_FORMAT)
+                print(f"Profiled {profile.summary()}, written to {path}")
+                await asyncio.to_thread(prune_profiles, PROFILE_DIR, PROFILE_MAX_FILES)
+            except Exception as e:
+                print(f"Error writing profile: {e}")
+
+
+class MongoProfilingListener(monitoring.CommandListener):
+    """
+    Adds each MongoDB command's round trip to the current profile. Motor
+    runs commands on worker threads with the request's context copied over.
+    """
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.add("mongo", event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+class _ProfiledRedisIO:
+    # Time spent writing commands and waiting for replies on a pooled connection
+    async def send_packed_command(self, command, check_health=True):
+        profile = _current_profile.get()
+        if profile is None:
+            return await super().send_packed_command(command, check_health)
+        start = time.perf_counter()
+        try:
+            return await super().send_packed_command(command, check_health)
+        finally:
+            profile.add("redis", time.perf_counter() - start)
+
+    async def read_response(self, *args, **kwargs):
+        profile = _current_profile.get()
+        if profile is None:
+            return await super().read_response(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await super().read_response(*args, **kwargs)
+        finally:
+            # A pipeline reads several replies per send, count the round trip once
+            profile.add("redis", time.perf_counter() - start, calls=0)
+
+
+class ProfiledConnection(_ProfiledRedisIO, Connection):
+    pass
+
+
+class ProfiledSSLConnection(_ProfiledRedisIO, SSLConnection):
+    pass
@@ -0,0 +1,54 @@
+import hashlib
+import json
+from typing import List, Optional
+
+# Redis keys written by recommendations_job.py and read by the API
+BOOK_RECS_KEY_PREFIX = "recs:book"
+USER_RECS_KEY_PREFIX = "recs:user"
+BOOK_META_KEY_PREFIX = "recs:meta"
+DIRTY_BOOKS_KEY = "recs:dirty_books"
+DIRTY_USERS_KEY = "recs:dirty_users"
+LAST_RUN_KEY = "recs:last_run"
+
+
+def book_key(bookname: str, bookauthor: str) -> str:
+    """
+    Stable id for a book. Reviews only store free-text name and author,
+    so the same book is matched case- and whitespace-insensitively.
+    """
+    normalized = f"{' '.join(bookname.lower().split())}|{' '.join(bookauthor.lower().split())}"
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def book_recs_key(key: str) -> str:
+    return f"{BOOK_RECS_KEY_PREFIX}:{key}"
+
+
+def user_recs_key(user_id: str) -> str:
+    return f"{USER_RECS_KEY_PREFIX}:{user_id}"
+
+
+async def mark_dirty(redis_client, user_id: str, *books):
+    """
+    Record that reviews for these (bookname, bookauthor) pairs changed, so
+    the next incremental job run only recomputes what was touched.
+    """
+    keys = [book_key(name, author) for name, author in books if name and author]
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            if keys:
+                pipe.sadd(DIRTY_BOOKS_KEY, *keys)
+            pipe.sadd(DIRTY_USERS_KEY, user_id)
+            await pipe.execute()
+    except Exception as e:
+        print(f"Error marking recommendations dirty: {e}")
+
+
+async def get_recommendations(redis_client, key: str) -> Optional[List[dict]]:
+    """
+    Read a precomputed recommendation list. Returns None if there is none yet.
+    """
+    cached = await redis_client.get(key)
+    if cached is None:
+        return None
+    return json.loads(cached)
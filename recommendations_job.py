@@ -0,0 +1,482 @@
+"""
+Offline job that precomputes book recommendations.
+
+Builds a sparse user x book rating matrix from reviews_collection and
+computes item-item cosine similarities with vectorized NumPy/SciPy
+operations. The top-N similar books per book and the top-N recommended
+books per user are written to Redis, where the API serves them with a
+single GET.
+
+Usage:
+    python recommendations_job.py                    # full rebuild
+    python recommendations_job.py --incremental      # only books touched since the last run
+    python recommendations_job.py --synthetic 1000000  # build on synthetic data, report time and memory
+"""
+import argparse
+import json
+import os
+import resource
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np  # type: ignore
+import scipy.sparse as sp  # type: ignore
+from dotenv import load_dotenv
+from recommendations import (
+    DIRTY_BOOKS_KEY,
+    DIRTY_USERS_KEY,
+    LAST_RUN_KEY,
+    book_key,
+    book_recs_key,
+    user_recs_key,
+)
+
+# Load environment variables from .env file
+load_dotenv()
+
+TOP_N = int(os.getenv("RECS_TOP_N", "20"))
+
+# Where the neighbor index is kept between runs for incremental refreshes
+STATE_PATH = os.getenv("RECS_STATE_PATH", "recommendations_state.npz")
+
+# Ratings are centered on the middle of the 0-5 scale so low ratings count against a book
+RATING_MIDPOINT = 2.5
+
+# Books or users scored per sparse matrix product
+BLOCK_SIZE = 2048
+
+# Incremental refreshes touching more books than this fall back to a full rebuild
+INCREMENTAL_MAX_BOOKS = int(os.getenv("RECS_INCREMENTAL_MAX_BOOKS", "2000"))
+
+
+class RatingMatrix:
+    def __init__(self, users: np.ndarray, books: np.ndarray, ratings: sp.csr_matrix, rated: sp.csr_matrix, titles: Dict[str, Tuple[str, str]]):
+        self.users = users      # sorted user ids, one per row
+        self.books = books      # sorted book keys, one per column
+        self.ratings = ratings  # centered ratings, users x books
+        self.rated = rated      # 1.0 where the user reviewed the book
+        self.titles = titles    # book key -> (bookname, bookauthor)
+
+
+def build_matrix(user_ids: List[str], book_keys: List[str], ratings: List[float], titles: Dict[str, Tuple[str, str]]) -> RatingMatrix:
+    users, user_codes = np.unique(np.asarray(user_ids, dtype=object), return_inverse=True)
+    books, book_codes = np.unique(np.asarray(book_keys, dtype=object), return_inverse=True)
+    n_users, n_books = len(users), len(books)
+
+    # A user may review the same book more than once; average those ratings
+    pairs = user_codes.astype(np.int64) * n_books + book_codes
+    unique_pairs, pair_codes = np.unique(pairs, return_inverse=True)
+    sums = np.bincount(pair_codes, weights=np.asarray(ratings, dtype=np.float64))
+    counts = np.bincount(pair_codes)
+    values = (sums / counts - RATING_MIDPOINT).astype(np.float32)
+
+    rows = (unique_pairs // n_books).astype(np.int32)
+    cols = (unique_pairs % n_books).astype(np.int32)
+    shape = (n_users, n_books)
+    ratings_matrix = sp.csr_matrix((values, (rows, cols)), shape=shape)
+    rated = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+    return RatingMatrix(users, books, ratings_matrix, rated, titles)
+
+
+def _normalized_columns(ratings: sp.csr_matrix) -> Tuple[sp.csc_matrix, sp.csr_matrix]:
+    norms = np.sqrt(np.asarray(ratings.multiply(ratings).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    normalized = (ratings @ sp.diags((1.0 / norms).astype(np.float32))).tocsc()
+    return normalized, normalized.T.tocsr()
+
+
+def _blocks(items: np.ndarray, size: int = BLOCK_SIZE) -> Iterable[np.ndarray]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _top_n_per_row(scores: sp.csr_matrix, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Column indices and values of the top_n largest positive entries in each
+    row of a sparse matrix, sorted descending and padded with -1 / 0.
+    Vectorized: one lexsort over the stored entries, no per-row Python loop.
+    """
+    n_rows = scores.shape[0]
+    top = np.full((n_rows, top_n), -1, dtype=np.int32)
+    values = np.zeros((n_rows, top_n), dtype=np.float32)
+
+    rows = np.repeat(np.arange(n_rows), np.diff(scores.indptr))
+    positive = scores.data > 0
+    rows, cols, data = rows[positive], scores.indices[positive], scores.data[positive]
+    if not len(data):
+        return top, values
+
+    order = np.lexsort((-data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    row_starts = np.searchsorted(rows, np.arange(n_rows))
+    rank = np.arange(len(rows)) - row_starts[rows]
+    keep = rank < top_n
+    top[rows[keep], rank[keep]] = cols[keep]
+    values[rows[keep], rank[keep]] = data[keep]
+    return top, values
+
+
+def item_neighbors(matrix: RatingMatrix, columns: np.ndarray, top_n: int = TOP_N, similarities_out: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-N cosine neighbors for the given book columns.
+    If similarities_out (books x len(columns)) is given, the full similarity
+    column of every requested book is copied into it (used by the incremental refresh).
+    """
+    n_books = len(matrix.books)
+    normalized, normalized_t = _normalized_columns(matrix.ratings)
+    width = min(top_n, max(1, n_books - 1))
+    neighbors = np.empty((len(columns), width), dtype=np.int32)
+    sims = np.empty((len(columns), width), dtype=np.float32)
+
+    offset = 0
+    for block in _blocks(columns):
+        # Row j holds the similarity of block[j] to every book
+        scores = (normalized_t[block] @ normalized).tocsr()
+        if similarities_out is not None:
+            similarities_out[:, offset:offset + len(block)] = scores.toarray().T
+        # A book is not its own neighbor
+        scores = scores - sp.csr_matrix(
+            (scores[np.arange(len(block)), block].A1, (np.arange(len(block)), block)), shape=scores.shape
+        )
+        top, values = _top_n_per_row(scores.tocsr(), width)
+        neighbors[offset:offset + len(block)] = top
+        sims[offset:offset + len(block)] = values
+        offset += len(block)
+    return neighbors, sims
+
+
+def neighbor_matrix(neighbors: np.ndarray, sims: np.ndarray) -> sp.csr_matrix:
+    """
+    Sparse books x books matrix where row i holds the similarities of book i's top-N neighbors.
+    """
+    n_books = neighbors.shape[0]
+    rows = np.repeat(np.arange(n_books, dtype=np.int32), neighbors.shape[1])
+    cols = neighbors.ravel()
+    keep = cols >= 0
+    return sp.csr_matrix((sims.ravel()[keep], (rows[keep], cols[keep])), shape=(n_books, n_books))
+
+
+def user_recommendations(matrix: RatingMatrix, neighbors_csr: sp.csr_matrix, rows: np.ndarray, top_n: int = TOP_N) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score every book for each user as the similarity-weighted sum of the
+    user's centered ratings, skip books already reviewed, keep the top N.
+    """
+    width = min(top_n, len(matrix.books))
+    books = np.empty((len(rows), width), dtype=np.int32)
+    scores_out = np.empty((len(rows), width), dtype=np.float32)
+
+    offset = 0
+    for block in _blocks(rows):
+        scores = (matrix.ratings[block] @ neighbors_csr).tocsr()
+        # Drop books the user has already reviewed
+        scores = scores - scores.multiply(matrix.rated[block])
+        top, values = _top_n_per_row(scores.tocsr(), width)
+        books[offset:offset + len(block)] = top
+        scores_out[offset:offset + len(block)] = values
+        offset += len(block)
+    return books, scores_out
+
+
+def _recommendation_list(matrix: RatingMatrix, indices: np.ndarray, scores: np.ndarray) -> str:
+    items = []
+    for index, score in zip(indices.tolist(), scores.tolist()):
+        if index < 0:
+            break
+        bookname, bookauthor = matrix.titles[matrix.books[index]]
+        items.append({"bookname": bookname, "bookauthor": bookauthor, "score": round(score, 4)})
+    return json.dumps(items)
+
+
+def write_book_recs(redis_client, matrix: RatingMatrix, columns: np.ndarray, neighbors: np.ndarray, sims: np.ndarray, batch: int = 1000):
+    pipe = redis_client.pipeline(transaction=False)
+    for n, (column, row_neighbors, row_sims) in enumerate(zip(columns, neighbors, sims), 1):
+        pipe.set(book_recs_key(matrix.books[column]), _recommendation_list(matrix, row_neighbors, row_sims))
+        if n % batch == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def write_user_recs(redis_client, matrix: RatingMatrix, rows: np.ndarray, books: np.ndarray, scores: np.ndarray, batch: int = 1000):
+    pipe = redis_client.pipeline(transaction=False)
+    for n, (row, row_books, row_scores) in enumerate(zip(rows, books, scores), 1):
+        pipe.set(user_recs_key(matrix.users[row]), _recommendation_list(matrix, row_books, row_scores))
+        if n % batch == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def delete_keys(redis_client, keys: List[str], batch: int = 1000):
+    for start in range(0, len(keys), batch):
+        redis_client.delete(*keys[start:start + batch])
+
+
+def load_reviews(reviews_collection) -> Tuple[List[str], List[str], List[float], Dict[str, Tuple[str, str]]]:
+    user_ids, book_keys, ratings = [], [], []
+    titles: Dict[str, Tuple[str, str]] = {}
+    cursor = reviews_collection.find(
+        {}, {"_id": 0, "user_id": 1, "bookname": 1, "bookauthor": 1, "rating": 1}
+    ).batch_size(10000)
+    for review in cursor:
+        if not review.get("bookname") or not review.get("bookauthor") or review.get("rating") is None:
+            continue
+        key = book_key(review["bookname"], review["bookauthor"])
+        titles.setdefault(key, (review["bookname"], review["bookauthor"]))
+        user_ids.append(review["user_id"])
+        book_keys.append(key)
+        ratings.append(float(review["rating"]))
+    return user_ids, book_keys, ratings, titles
+
+
+def save_state(path: str, matrix: RatingMatrix, neighbors: np.ndarray, sims: np.ndarray):
+    np.savez(path, books=matrix.books.astype(str), users=matrix.users.astype(str), neighbors=neighbors, sims=sims)
+
+
+def load_state(path: str, matrix: RatingMatrix) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Load the previous neighbor index and re-map it onto the current book columns.
+    Books that no longer exist are dropped, and the rows that pointed at them
+    are flagged. Returns None if there is no usable state.
+    """
+    if not os.path.exists(path):
+        return None
+    state = np.load(path)
+    old_books = state["books"].astype(object)
+    old_neighbors, old_sims = state["neighbors"], state["sims"]
+    if old_neighbors.shape[1] != min(TOP_N, max(1, len(old_books) - 1)):
+        return None
+
+    # old column -> new column (-1 if the book is gone)
+    positions = np.searchsorted(matrix.books, old_books)
+    positions = np.clip(positions, 0, len(matrix.books) - 1)
+    old_to_new = np.where(matrix.books[positions] == old_books, positions, -1).astype(np.int32)
+
+    width = min(TOP_N, max(1, len(matrix.books) - 1))
+    neighbors = np.full((len(matrix.books), width), -1, dtype=np.int32)
+    sims = np.zeros((len(matrix.books), width), dtype=np.float32)
+    present = old_to_new >= 0
+    copy = min(width, old_neighbors.shape[1])
+    remapped = np.where(old_neighbors[:, :copy] >= 0, old_to_new[old_neighbors[:, :copy]], -1)
+    neighbors[old_to_new[present], :copy] = remapped[present]
+    sims[old_to_new[present], :copy] = old_sims[present, :copy]
+    sims[neighbors < 0] = 0
+
+    lost_neighbor = np.zeros(len(matrix.books), dtype=bool)
+    lost_neighbor[old_to_new[present]] = ((remapped < 0) & (old_neighbors[:, :copy] >= 0))[present].any(axis=1)
+    return neighbors, sims, lost_neighbor, old_books[~present], state["users"].astype(object)
+
+
+def full_rebuild(redis_client, matrix: RatingMatrix, old_books=None, old_users=None) -> dict:
+    stats = {}
+    start = time.perf_counter()
+    columns = np.arange(len(matrix.books))
+    neighbors, sims = item_neighbors(matrix, columns)
+    stats["item_similarity_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = np.arange(len(matrix.users))
+    books, scores = user_recommendations(matrix, neighbor_matrix(neighbors, sims), rows)
+    stats["user_recommendation_seconds"] = time.perf_counter() - start
+
+    if redis_client is not None:
+        start = time.perf_counter()
+        write_book_recs(redis_client, matrix, columns, neighbors, sims)
+        write_user_recs(redis_client, matrix, rows, books, scores)
+        if old_books is not None:
+            gone = np.setdiff1d(old_books.astype(str), matrix.books.astype(str))
+            delete_keys(redis_client, [book_recs_key(k) for k in gone])
+        if old_users is not None:
+            gone = np.setdiff1d(old_users.astype(str), matrix.users.astype(str))
+            delete_keys(redis_client, [user_recs_key(u) for u in gone])
+        stats["redis_write_seconds"] = time.perf_counter() - start
+        save_state(STATE_PATH, matrix, neighbors, sims)
+
+    stats.update({"books_updated": len(columns), "users_updated": len(rows)})
+    return stats
+
+
+def incremental_refresh(redis_client, matrix: RatingMatrix, dirty_books: List[str], dirty_users: List[str]) -> Optional[dict]:
+    """
+    Recompute neighbors only for books whose reviews changed (and for lists
+    that held one of them), merge the changed books into the neighbor lists
+    of every other book they are similar to, and recompute recommendations
+    only for users who rated an affected book.
+    Returns None if there is no previous state to build on.
+    """
+    state = load_state(STATE_PATH, matrix)
+    if state is None:
+        return None
+    neighbors, sims, lost_neighbor, removed_books, old_users = state
+
+    dirty_set = set(dirty_books)
+    dirty_columns = np.array([i for i, key in enumerate(matrix.books) if key in dirty_set], dtype=np.int64)
+    start = time.perf_counter()
+
+    is_dirty = np.zeros(len(matrix.books), dtype=bool)
+    is_dirty[dirty_columns] = True
+
+    # Lists that held a dirty or removed book may need a replacement from
+    # further down the ranking, so they are recomputed exactly with the dirty books
+    stale = (np.isin(neighbors, dirty_columns).any(axis=1) | lost_neighbor) & ~is_dirty
+    recompute = np.concatenate([dirty_columns, np.flatnonzero(stale)])
+    if len(recompute) > INCREMENTAL_MAX_BOOKS:
+        # Too much changed for patching to be cheaper than a rebuild
+        return None
+    changed = is_dirty | stale
+
+    # Similarity of every book to each dirty book
+    dirty_sims = np.zeros((len(matrix.books), len(dirty_columns)), dtype=np.float32)
+    if len(recompute):
+        new_neighbors, new_sims = item_neighbors(matrix, dirty_columns, similarities_out=dirty_sims)
+        stale_neighbors, stale_sims = item_neighbors(matrix, np.flatnonzero(stale))
+        neighbors[recompute] = np.concatenate([new_neighbors, stale_neighbors])
+        sims[recompute] = np.concatenate([new_sims, stale_sims])
+        dirty_sims[dirty_columns, np.arange(len(dirty_columns))] = 0
+
+    # Every other list holds no dirty book, so merging in the new dirty
+    # similarities and truncating gives the exact top N
+    width = neighbors.shape[1]
+    merge = (dirty_sims > 0).any(axis=1) & ~changed
+    for book in np.flatnonzero(merge):
+        keep = neighbors[book] >= 0
+        candidates = np.concatenate([neighbors[book][keep], dirty_columns.astype(np.int32)])
+        candidate_sims = np.concatenate([sims[book][keep], dirty_sims[book]])
+        valid = candidate_sims > 0
+        candidates, candidate_sims = candidates[valid], candidate_sims[valid]
+        order = np.argsort(-candidate_sims, kind="stable")[:width]
+        neighbors[book] = -1
+        sims[book] = 0
+        neighbors[book, :len(order)] = candidates[order]
+        sims[book, :len(order)] = candidate_sims[order]
+    changed |= merge
+
+    changed_columns = np.flatnonzero(changed)
+    stats = {"item_similarity_seconds": time.perf_counter() - start}
+
+    # Users whose scores depend on a changed neighbor list, plus users whose own ratings changed
+    start = time.perf_counter()
+    affected = set(np.unique(matrix.rated[:, changed_columns].nonzero()[0]).tolist())
+    dirty_user_set = set(dirty_users)
+    affected.update(i for i, user in enumerate(matrix.users) if user in dirty_user_set)
+    rows = np.array(sorted(affected), dtype=np.int64)
+    books, scores = user_recommendations(matrix, neighbor_matrix(neighbors, sims), rows)
+    stats["user_recommendation_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_book_recs(redis_client, matrix, changed_columns, neighbors[changed_columns], sims[changed_columns])
+    write_user_recs(redis_client, matrix, rows, books, scores)
+    delete_keys(redis_client, [book_recs_key(k) for k in removed_books])
+    gone_users = np.setdiff1d(old_users.astype(str), matrix.users.astype(str))
+    delete_keys(redis_client, [user_recs_key(u) for u in gone_users])
+    stats["redis_write_seconds"] = time.perf_counter() - start
+    save_state(STATE_PATH, matrix, neighbors, sims)
+
+    stats.update({"books_updated": len(changed_columns), "users_updated": len(rows)})
+    return stats
+
+
+def take_dirty(redis_client, key: str) -> Tuple[Optional[str], List[str]]:
+    """
+    Atomically move a dirty set aside so writes during the run are kept for the next one.
+    """
+    processing_key = f"{key}:processing"
+    # Merges into any set a failed previous run left behind
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.sunionstore(processing_key, [processing_key, key])
+    pipe.delete(key)
+    pipe.execute()
+    members = redis_client.smembers(processing_key)
+    if not members:
+        return None, []
+    return processing_key, [m.decode("utf-8") for m in members]
+
+
+def synthetic_reviews(n_reviews: int, seed: int = 42):
+    """
+    Synthetic reviews with Zipf-like book popularity, for sizing the job.
+    """
+    rng = np.random.default_rng(seed)
+    n_users = max(1, n_reviews // 10)
+    n_books = max(2, n_reviews // 20)
+    popularity = 1.0 / np.arange(1, n_books + 1) ** 0.8
+    popularity /= popularity.sum()
+    users = rng.integers(0, n_users, n_reviews)
+    books = rng.choice(n_books, n_reviews, p=popularity)
+    ratings = rng.integers(0, 11, n_reviews) / 2.0
+    user_ids = [f"user{u}" for u in users]
+    book_keys = [f"book{b:08d}" for b in books]
+    titles = {f"book{b:08d}": (f"Book {b}", f"Author {b % 997}") for b in range(n_books)}
+    return user_ids, book_keys, ratings.tolist(), titles
+
+
+def peak_memory_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute ReviewVerse book recommendations")
+    parser.add_argument("--incremental", action="store_true", help="only recompute books touched since the last run")
+    parser.add_argument("--synthetic", type=int, help="build from this many synthetic reviews without Mongo or Redis")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.synthetic:
+        user_ids, book_keys, ratings, titles = synthetic_reviews(args.synthetic)
+        redis_client = None
+    else:
+        import redis  # type: ignore
+        from pymongo import MongoClient
+
+        mongo = MongoClient(os.getenv("MONGO_URI"))
+        redis_client = redis.Redis(
+            host=os.getenv("REDIS_HOST"),
+            port=os.getenv("REDIS_PORT"),
+            password=os.getenv("REDIS_PASSWORD"),
+            ssl=os.getenv("REDIS_SSL") == "True",
+        )
+        user_ids, book_keys, ratings, titles = load_reviews(mongo["reviewverse_db"]["reviews"])
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix = build_matrix(user_ids, book_keys, ratings, titles)
+    matrix_seconds = time.perf_counter() - start
+    del user_ids, book_keys, ratings
+
+    stats = None
+    processing_keys: List[str] = []
+    if args.incremental and redis_client is not None:
+        books_key, dirty_books = take_dirty(redis_client, DIRTY_BOOKS_KEY)
+        users_key, dirty_users = take_dirty(redis_client, DIRTY_USERS_KEY)
+        processing_keys = [k for k in (books_key, users_key) if k]
+        stats = incremental_refresh(redis_client, matrix, dirty_books, dirty_users)
+        if stats is None:
+            print("No previous state found, running a full rebuild")
+    if stats is None:
+        old_books = old_users = None
+        if redis_client is not None and os.path.exists(STATE_PATH):
+            previous = np.load(STATE_PATH)
+            old_books, old_users = previous["books"].astype(object), previous["users"].astype(object)
+        stats = full_rebuild(redis_client, matrix, old_books, old_users)
+
+    if processing_keys:
+        redis_client.delete(*processing_keys)
+
+    stats.update({
+        "load_seconds": load_seconds,
+        "matrix_seconds": matrix_seconds,
+        "reviews": int(matrix.rated.nnz),
+        "users": len(matrix.users),
+        "books": len(matrix.books),
+        "matrix_mb": (matrix.ratings.data.nbytes + matrix.ratings.indices.nbytes + matrix.ratings.indptr.nbytes) / 1e6,
+        "peak_memory_mb": peak_memory_mb(),
+        "finished_at": datetime.now().isoformat(),
+    })
+    if redis_client is not None:
+        redis_client.set(LAST_RUN_KEY, json.dumps(stats))
+
+    for key, value in stats.items():
+        print(f"{key}: {round(value, 3) if isinstance(value, float) else value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,596 @@
+"""
+Ranked full-text search over reviews.
+
+An in-process inverted index over experience, bookname and bookauthor,
+ranked with BM25. Each worker builds it from MongoDB at startup and keeps
+it current by reading a Redis stream of changed review ids, so a write on
+any worker shows up in search within SEARCH_SYNC_INTERVAL seconds.
+
+Postings are flat NumPy arrays: one compressed block built from MongoDB,
+plus an append-only block for reviews written since. An update marks the
+old copy deleted and appends the new one; the periodic rebuild compacts
+everything again. The /filter facets are stored as per-review columns, so
+a query only goes to MongoDB to load the page it returns.
+
+Size check without Mongo or Redis:
+    python search_index.py --synthetic 1000000
+"""
+import argparse
+import asyncio
+import math
+import operator
+import os
+import re
+import resource
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import numpy as np  # type: ignore
+import scipy.sparse as sp  # type: ignore
+from bson import ObjectId
+
+# BM25 parameters: term frequency saturation and document length normalization
+SEARCH_BM25_K1 = float(os.getenv("SEARCH_BM25_K1", "1.2"))
+SEARCH_BM25_B = float(os.getenv("SEARCH_BM25_B", "0.75"))
+
+# A word in the book name or author counts as this many words of review text
+SEARCH_TITLE_BOOST = int(os.getenv("SEARCH_TITLE_BOOST", "3"))
+
+# Seconds between reads of the change stream, and hours between full rebuilds
+SEARCH_SYNC_INTERVAL = float(os.getenv("SEARCH_SYNC_INTERVAL", "1"))
+SEARCH_REBUILD_HOURS = float(os.getenv("SEARCH_REBUILD_HOURS", "24"))
+
+# Change stream entries kept in Redis (approximate)
+SEARCH_CHANGES_MAXLEN = int(os.getenv("SEARCH_CHANGES_MAXLEN", "100000"))
+
+CHANGES_KEY = "search:changes"
+
+MAX_QUERY_TERMS = 16
+BUILD_BATCH = 5000
+
+READING_STATUSES = ("start", "continue", "finished")
+BUY_PLACES = ("online", "offline")
+
+PROJECTION = {
+    "experience": 1, "bookname": 1, "bookauthor": 1,
+    "readingstatus": 1, "rating": 1, "buyplace": 1, "satisfied": 1,
+}
+
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be been but by can could did do does for from had has have
+he her his how i if in into is it its just me more my no not of on or our out she so some such than that
+the their them then there these they this to too up us was we were what when which who will with would you your
+""".split())
+
+# Words of two or more characters
+TOKEN_RE = re.compile(r"\w\w+")
+
+RATING_OPERATORS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+    "=": operator.eq,
+}
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def review_terms(review: dict) -> Counter:
+    # Count first and drop stopwords per distinct word, it is much cheaper than per token
+    counts = Counter(TOKEN_RE.findall((review.get("experience") or "").lower()))
+    for token in TOKEN_RE.findall(f"{review.get('bookname') or ''} {review.get('bookauthor') or ''}".lower()):
+        counts[token] += SEARCH_TITLE_BOOST
+    for token in counts.keys() & STOPWORDS:
+        del counts[token]
+    return counts
+
+
+def parse_rating(rating: str) -> Tuple[str, float]:
+    """
+    Parse a /filter style rating facet (">3", "<=4.5", "5"). Raises ValueError.
+    """
+    rating = rating.strip()
+    for symbol in RATING_OPERATORS:
+        if rating.startswith(symbol):
+            return symbol, float(rating[len(symbol):])
+    return "=", float(rating)
+
+
+def _code(value, choices: Tuple[str, ...]) -> int:
+    # 0 means missing or unknown
+    return choices.index(value) + 1 if value in choices else 0
+
+
+def bm25_impacts(tfs: np.ndarray, lengths: np.ndarray, average_length: float) -> np.ndarray:
+    """
+    The BM25 term-frequency part of each posting's score; a query multiplies it by the term's idf.
+    """
+    k1, b = SEARCH_BM25_K1, SEARCH_BM25_B
+    tf = tfs.astype(np.float32)
+    return tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths / np.float32(average_length)))
+
+
+def _grow(column: np.ndarray, capacity: int) -> np.ndarray:
+    grown = np.zeros(capacity, dtype=column.dtype)
+    grown[:len(column)] = column
+    return grown
+
+
+class SearchIndex:
+    """
+    Documents are numbered in insertion order. Numbers below base_size are
+    in the compressed block and sorted by review id; later numbers were
+    appended by upsert() and are found through delta_positions.
+
+    The compressed block stores each posting's precomputed BM25 impact
+    (float16), so queries on common words skip the per-document length
+    lookups. Impacts use the average review length at build time until the
+    next rebuild.
+    """
+    COLUMNS = ("object_ids", "lengths", "book", "status", "place", "satisfied", "rating", "alive")
+
+    def __init__(self, vocab: Dict[str, int], indptr: np.ndarray, post_docs: np.ndarray, post_impacts: np.ndarray,
+                 columns: Dict[str, np.ndarray], books: List[Tuple[str, str]]):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.post_docs = post_docs
+        self.post_impacts = post_impacts
+        self.delta: Dict[str, Tuple[array, array]] = {}
+
+        self.size = self.base_size = len(columns["object_ids"])
+        self.object_ids = columns["object_ids"]  # review _id bytes (S12, trailing zero bytes are trimmed by NumPy)
+        self.lengths = columns["lengths"]        # weighted token count
+        self.book = columns["book"]              # index into books
+        self.status = columns["status"]          # readingstatus code
+        self.place = columns["place"]            # buyplace code
+        self.satisfied = columns["satisfied"]    # 1, 0, or -1 when missing
+        self.rating = columns["rating"]          # NaN when missing
+        self.alive = columns["alive"]
+
+        self.books = books
+        self.book_index = {book: i for i, book in enumerate(books)}
+        self.delta_positions: Dict[bytes, int] = {}
+        self.live = int(self.alive.sum())
+        self.total_length = float(self.lengths[self.alive].sum())
+        # Searches run on worker threads; changes are applied between them
+        self.lock = threading.Lock()
+
+    # Writes
+
+    def _position(self, oid: bytes) -> Optional[int]:
+        position = self.delta_positions.get(oid)
+        if position is not None:
+            return position
+        i = int(np.searchsorted(self.object_ids[:self.base_size], oid))
+        if i < self.base_size and bytes(self.object_ids[i]).ljust(12, b"\0") == oid:
+            return i
+        return None
+
+    def remove(self, review_id: ObjectId):
+        position = self._position(review_id.binary)
+        if position is not None and self.alive[position]:
+            self.alive[position] = False
+            self.live -= 1
+            self.total_length -= float(self.lengths[position])
+
+    def apply(self, found: Dict[ObjectId, dict], review_ids):
+        # One batch of changed reviews: re-index those still in MongoDB, drop the rest
+        with self.lock:
+            for review_id in review_ids:
+                if review_id in found:
+                    self.upsert(found[review_id])
+                else:
+                    self.remove(review_id)
+
+    def upsert(self, review: dict):
+        self.remove(review["_id"])
+        if self.size == len(self.object_ids):
+            capacity = max(1024, 2 * self.size)
+            for name in self.COLUMNS:
+                setattr(self, name, _grow(getattr(self, name), capacity))
+
+        position = self.size
+        self.size += 1
+        terms = review_terms(review)
+        length = sum(terms.values())
+        book = (review.get("bookname") or "", review.get("bookauthor") or "")
+        if book not in self.book_index:
+            self.book_index[book] = len(self.books)
+            self.books.append(book)
+
+        self.object_ids[position] = review["_id"].binary
+        self.lengths[position] = length
+        self.book[position] = self.book_index[book]
+        self.status[position] = _code(review.get("readingstatus"), READING_STATUSES)
+        self.place[position] = _code(review.get("buyplace"), BUY_PLACES)
+        satisfied = review.get("satisfied")
+        self.satisfied[position] = -1 if satisfied is None else int(bool(satisfied))
+        rating = review.get("rating")
+        self.rating[position] = np.nan if rating is None else float(rating)
+        self.alive[position] = True
+        self.delta_positions[review["_id"].binary] = position
+        self.live += 1
+        self.total_length += length
+
+        for term, tf in terms.items():
+            postings = self.delta.get(term)
+            if postings is None:
+                postings = self.delta[term] = (array("i"), array("B"))
+            postings[0].append(position)
+            postings[1].append(min(tf, 255))
+
+    # Reads
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        docs, impacts = [], []
+        term_id = self.vocab.get(term)
+        if term_id is not None:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs.append(self.post_docs[start:end])
+            impacts.append(self.post_impacts[start:end])
+        postings = self.delta.get(term)
+        if postings is not None:
+            # Copy so the array module buffers are not held by NumPy views
+            delta_docs = np.frombuffer(postings[0], dtype=np.int32).copy()
+            tfs = np.frombuffer(postings[1], dtype=np.uint8).copy()
+            docs.append(delta_docs)
+            impacts.append(bm25_impacts(tfs, self.lengths[delta_docs], max(1.0, self.total_length / max(1, self.live))))
+        if not docs:
+            return np.zeros(0, np.int32), np.zeros(0, np.float32)
+        if len(docs) == 1:
+            return docs[0], impacts[0]
+        return np.concatenate(docs), np.concatenate(impacts)
+
+    def _facet_mask(self, docs: np.ndarray, bookname: Optional[str], bookauthor: Optional[str], readingstatus: Optional[str],
+                    rating: Optional[Tuple[str, float]], buyplace: Optional[str], satisfied: Optional[bool]) -> np.ndarray:
+        keep = self.alive[docs]
+        if bookname or bookauthor:
+            # Case-insensitive substring match, run once per distinct book. Plain
+            # substrings, not regexes: a crafted pattern could otherwise backtrack for minutes
+            name_part = bookname.lower() if bookname else ""
+            author_part = bookauthor.lower() if bookauthor else ""
+            matching = np.fromiter(
+                (name_part in name.lower() and author_part in author.lower() for name, author in self.books),
+                dtype=bool, count=len(self.books),
+            )
+            keep &= matching[self.book[docs]]
+        if readingstatus:
+            keep &= self.status[docs] == _code(readingstatus, READING_STATUSES)
+        if rating:
+            symbol, value = rating
+            keep &= RATING_OPERATORS[symbol](self.rating[docs], value)
+        if buyplace:
+            keep &= self.place[docs] == _code(buyplace, BUY_PLACES)
+        if satisfied is not None:
+            keep &= self.satisfied[docs] == int(satisfied)
+        return keep
+
+    def search(self, query: str, offset: int = 0, limit: int = 10, bookname: Optional[str] = None, bookauthor: Optional[str] = None,
+               readingstatus: Optional[str] = None, rating: Optional[Tuple[str, float]] = None, buyplace: Optional[str] = None,
+               satisfied: Optional[bool] = None) -> Tuple[int, List[Tuple[ObjectId, float]]]:
+        """
+        BM25-ranked reviews matching any query term and every given facet
+        (bookname and bookauthor match case-insensitive substrings).
+        Returns the total number of matches and one page of (review id, score).
+        Can take tens of milliseconds on a large index, so call it off the event loop.
+        """
+        with self.lock:
+            return self._search(query, offset, limit, bookname, bookauthor, readingstatus, rating, buyplace, satisfied)
+
+    def _search(self, query: str, offset: int, limit: int, bookname: Optional[str], bookauthor: Optional[str],
+                readingstatus: Optional[str], rating: Optional[Tuple[str, float]], buyplace: Optional[str],
+                satisfied: Optional[bool]) -> Tuple[int, List[Tuple[ObjectId, float]]]:
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not terms or self.live == 0:
+            return 0, []
+
+        doc_parts, weight_parts = [], []
+        for term in terms:
+            docs, impacts = self._postings(term)
+            if len(docs) == 0:
+                continue
+            # Deleted copies stay in the postings until the next rebuild
+            df = min(len(docs), self.live)
+            idf = math.log(1 + (self.live - df + 0.5) / (df + 0.5))
+            doc_parts.append(docs)
+            weight_parts.append(np.multiply(impacts, idf, dtype=np.float32))
+        if not doc_parts:
+            return 0, []
+
+        all_docs = np.concatenate(doc_parts)
+        all_weights = np.concatenate(weight_parts)
+        if len(all_docs) * 8 > self.size:
+            # Dense accumulation is cheaper than sorting when many reviews match
+            scores = np.bincount(all_docs, weights=all_weights, minlength=self.size)
+            candidates = np.flatnonzero(scores)
+            candidate_scores = scores[candidates]
+        else:
+            candidates, inverse = np.unique(all_docs, return_inverse=True)
+            candidate_scores = np.bincount(inverse, weights=all_weights)
+
+        keep = self._facet_mask(candidates, bookname, bookauthor, readingstatus, rating, buyplace, satisfied)
+        candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+        total = len(candidates)
+        end = min(offset + limit, total)
+        if offset >= end:
+            return total, []
+
+        if end < total:
+            top = np.argpartition(-candidate_scores, end - 1)[:end]
+        else:
+            top = np.arange(total)
+        # Highest score first, ties in index order so pages are stable
+        top = top[np.lexsort((candidates[top], -candidate_scores[top]))][offset:end]
+        return total, [
+            (ObjectId(bytes(self.object_ids[candidates[i]]).ljust(12, b"\0")), round(float(candidate_scores[i]), 4))
+            for i in top
+        ]
+
+    def memory_bytes(self) -> int:
+        size = self.indptr.nbytes + self.post_docs.nbytes + self.post_impacts.nbytes
+        size += sum(getattr(self, name).nbytes for name in self.COLUMNS)
+        size += sum(len(docs) * 5 for docs, _ in self.delta.values())
+        return size
+
+
+class IndexBuilder:
+    """
+    Accumulates reviews document by document, then lays the postings out
+    term-major in one pass (a CSR to CSC conversion).
+    """
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self.term_ids = array("i")
+        self.tfs = array("B")
+        self.doc_indptr = array("q", [0])
+        self.object_ids: List[bytes] = []
+        self.lengths = array("f")
+        self.book = array("i")
+        self.status = array("B")
+        self.place = array("B")
+        self.satisfied = array("b")
+        self.rating = array("f")
+        self.books: List[Tuple[str, str]] = []
+        self.book_index: Dict[Tuple[str, str], int] = {}
+
+    def add_many(self, reviews: List[dict]):
+        vocab = self.vocab
+        for review in reviews:
+            terms = review_terms(review)
+            for term in set(terms).difference(vocab):
+                vocab[term] = len(vocab)
+            self.term_ids.extend(map(vocab.__getitem__, terms))
+            tfs = terms.values()
+            self.tfs.extend(tfs if not tfs or max(tfs) < 256 else [min(tf, 255) for tf in tfs])
+            self.doc_indptr.append(len(self.term_ids))
+
+            book = (review.get("bookname") or "", review.get("bookauthor") or "")
+            book_id = self.book_index.get(book)
+            if book_id is None:
+                book_id = self.book_index[book] = len(self.books)
+                self.books.append(book)
+            self.object_ids.append(review["_id"].binary)
+            self.lengths.append(sum(terms.values()))
+            self.book.append(book_id)
+            self.status.append(_code(review.get("readingstatus"), READING_STATUSES))
+            self.place.append(_code(review.get("buyplace"), BUY_PLACES))
+            satisfied = review.get("satisfied")
+            self.satisfied.append(-1 if satisfied is None else int(bool(satisfied)))
+            rating = review.get("rating")
+            self.rating.append(math.nan if rating is None else float(rating))
+
+    def finish(self) -> SearchIndex:
+        n_docs = len(self.object_ids)
+        object_ids = np.array(self.object_ids, dtype="S12")
+        self.object_ids = []
+        # Review ids sorted, so lookups by id are a binary search
+        order = np.argsort(object_ids, kind="stable")
+
+        index_dtype = np.int32 if len(self.term_ids) < 2 ** 31 else np.int64
+        by_doc = sp.csr_matrix(
+            (
+                np.frombuffer(self.tfs, dtype=np.uint8),
+                np.frombuffer(self.term_ids, dtype=np.int32).astype(index_dtype, copy=False),
+                np.frombuffer(self.doc_indptr, dtype=np.int64).astype(index_dtype, copy=False),
+            ),
+            shape=(n_docs, max(1, len(self.vocab))),
+        )
+        by_term = by_doc[order].tocsc()
+        del by_doc
+
+        lengths = np.frombuffer(self.lengths, dtype=np.float32)[order]
+        post_docs = by_term.indices.astype(np.int32, copy=False)
+        average_length = max(1.0, float(lengths.mean())) if n_docs else 1.0
+        post_impacts = bm25_impacts(by_term.data, lengths[post_docs], average_length).astype(np.float16)
+
+        columns = {
+            "object_ids": object_ids[order],
+            "lengths": lengths,
+            "book": np.frombuffer(self.book, dtype=np.int32)[order],
+            "status": np.frombuffer(self.status, dtype=np.uint8)[order],
+            "place": np.frombuffer(self.place, dtype=np.uint8)[order],
+            "satisfied": np.frombuffer(self.satisfied, dtype=np.int8)[order],
+            "rating": np.frombuffer(self.rating, dtype=np.float32)[order],
+            "alive": np.ones(n_docs, dtype=bool),
+        }
+        return SearchIndex(
+            self.vocab,
+            by_term.indptr.astype(np.int64),
+            post_docs,
+            post_impacts,
+            columns,
+            self.books,
+        )
+
+
+async def build_index(reviews_collection) -> SearchIndex:
+    """
+    Read every review from MongoDB and build a fresh index. Tokenizing runs
+    in a worker thread, one batch at a time, so the event loop keeps serving.
+    """
+    builder = IndexBuilder()
+    batch = []
+    async for review in reviews_collection.find({}, PROJECTION, batch_size=BUILD_BATCH):
+        batch.append(review)
+        if len(batch) >= BUILD_BATCH:
+            await asyncio.to_thread(builder.add_many, batch)
+            batch = []
+    if batch:
+        await asyncio.to_thread(builder.add_many, batch)
+    return await asyncio.to_thread(builder.finish)
+
+
+async def record_change(redis_client, review_id: str):
+    """
+    Tell every worker's index that this review was added, updated or deleted.
+    """
+    try:
+        await redis_client.xadd(CHANGES_KEY, {"id": review_id}, maxlen=SEARCH_CHANGES_MAXLEN, approximate=True)
+    except Exception as e:
+        print(f"Error recording search index change: {e}")
+
+
+class SearchService:
+    """
+    Owns this worker's index: builds it in the background at startup,
+    applies changes from the stream, and rebuilds it every SEARCH_REBUILD_HOURS.
+    """
+    def __init__(self):
+        self.index: Optional[SearchIndex] = None
+        self.reviews_collection = None
+        self.redis_client = None
+        self.last_change = "0-0"
+        self.task = None
+
+    async def start(self, reviews_collection, redis_client):
+        self.reviews_collection = reviews_collection
+        self.redis_client = redis_client
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def rebuild(self):
+        # Changes after this point are replayed by sync(); replaying one the build already saw is harmless
+        latest = await self.redis_client.xrevrange(CHANGES_KEY, count=1)
+        last_change = latest[0][0] if latest else "0-0"
+        start = time.perf_counter()
+        index = await build_index(self.reviews_collection)
+        self.index, self.last_change = index, last_change
+        print(f"Search index built with {index.live} reviews in {time.perf_counter() - start:.1f} seconds")
+
+    async def sync(self, batch: int = 1000):
+        while True:
+            response = await self.redis_client.xread({CHANGES_KEY: self.last_change}, count=batch)
+            if not response:
+                return
+            entries = response[0][1]
+            ids = {ObjectId(fields[b"id"].decode("utf-8")) for _, fields in entries if ObjectId.is_valid(fields.get(b"id", b"").decode("utf-8"))}
+            found = {}
+            async for review in self.reviews_collection.find({"_id": {"$in": list(ids)}}, PROJECTION):
+                found[review["_id"]] = review
+            # Waits for in-flight searches, so apply off the event loop
+            await asyncio.to_thread(self.index.apply, found, ids)
+            self.last_change = entries[-1][0]
+            if len(entries) < batch:
+                return
+
+    async def run(self):
+        built_at = 0.0
+        while True:
+            try:
+                if self.index is None or time.monotonic() - built_at >= SEARCH_REBUILD_HOURS * 3600:
+                    await self.rebuild()
+                    built_at = time.monotonic()
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error updating search index: {e}")
+            await asyncio.sleep(SEARCH_SYNC_INTERVAL)
+
+
+search_service = SearchService()
+
+
+def synthetic_reviews(n_reviews: int, seed: int = 42):
+    """
+    Synthetic reviews with Zipf-like word frequencies, for sizing the index.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"w{i}" for i in range(50000)])
+    popularity = 1.0 / np.arange(1, len(vocabulary) + 1) ** 1.1
+    popularity /= popularity.sum()
+    n_books = max(2, n_reviews // 20)
+    lengths = rng.integers(20, 120, n_reviews)
+    words = rng.choice(len(vocabulary), int(lengths.sum()), p=popularity)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    books = rng.integers(0, n_books, n_reviews)
+    for i in range(n_reviews):
+        yield {
+            "_id": ObjectId(),
+            "experience": " ".join(vocabulary[words[offsets[i]:offsets[i + 1]]]),
+            "bookname": f"Book {books[i]}",
+            "bookauthor": f"Author {books[i] % 997}",
+            "readingstatus": READING_STATUSES[i % 3],
+            "rating": float(i % 11) / 2,
+            "buyplace": BUY_PLACES[i % 2],
+            "satisfied": i % 3 != 0,
+        }
+
+
+def peak_memory_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Size check for the ReviewVerse search index")
+    parser.add_argument("--synthetic", type=int, required=True, help="index this many synthetic reviews")
+    parser.add_argument("--queries", type=int, default=200, help="number of timed queries")
+    args = parser.parse_args(argv)
+
+    # Time only the indexing, not generating the synthetic text
+    build_seconds = 0.0
+    builder = IndexBuilder()
+    batch = []
+    for review in synthetic_reviews(args.synthetic):
+        batch.append(review)
+        if len(batch) >= BUILD_BATCH:
+            start = time.perf_counter()
+            builder.add_many(batch)
+            build_seconds += time.perf_counter() - start
+            batch = []
+    start = time.perf_counter()
+    builder.add_many(batch)
+    index = builder.finish()
+    build_seconds += time.perf_counter() - start
+
+    # Common, mid-frequency and rare words, alone, combined and with facets
+    rng = np.random.default_rng(7)
+    latencies = []
+    for i in range(args.queries):
+        words = [f"w{int(w)}" for w in rng.zipf(1.3, rng.integers(1, 4)) if w < 50000] or ["w1"]
+        facets = {"rating": (">=", 3.0), "buyplace": "online"} if i % 2 else {}
+        start = time.perf_counter()
+        index.search(" ".join(words), offset=(i % 5) * 10, limit=10, **facets)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    print(f"Indexed {index.live} reviews, {len(index.vocab)} terms, {len(index.post_docs)} postings in {build_seconds:.1f} seconds")
+    print(f"Index size {index.memory_bytes() / 1e6:.0f} MB, peak process memory {peak_memory_mb():.0f} MB")
+    print(f"Query latency p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms, max {latencies[-1] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Redis-backed login sessions.
+
+/login hands out a token "<session id>.<signature>". The signature is an
+HMAC of the session id with SESSION_SECRET, so forged or mangled tokens are
+rejected without touching Redis. The session itself is a Redis key holding
+the user's summary, so an authenticated call costs one Redis GET instead of
+a MongoDB lookup (and the login's bcrypt check is not repeated).
+
+Each user's session ids are also kept in a set so their sessions can be
+updated when the profile changes and dropped when the user is deleted.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+from typing import Optional
+
+SESSION_SECRET = os.getenv("SESSION_SECRET", "")
+
+# How long a session lasts after login (seconds)
+SESSION_TTL = int(os.getenv("SESSION_TTL", "86400"))
+
+# Every worker must sign with the same key, or a token only works on the worker that issued it
+if not SESSION_SECRET:
+    raise RuntimeError("SESSION_SECRET is not set; generate one with: python -c \"import secrets; print(secrets.token_urlsafe(32))\"")
+
+_secret = SESSION_SECRET.encode("utf-8")
+
+# User fields kept in the session
+SUMMARY_FIELDS = ("username", "email", "gender", "age", "currentrole")
+
+
+def session_key(session_id: str) -> str:
+    return f"session:{session_id}"
+
+
+def user_sessions_key(user_id: str) -> str:
+    return f"user_sessions:{user_id}"
+
+
+def _sign(session_id: str) -> str:
+    digest = hmac.new(_secret, session_id.encode("utf-8"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+def _session_id(token: str) -> Optional[str]:
+    # The session id of a correctly signed token, None otherwise
+    session_id, _, signature = token.partition(".")
+    # Compare bytes: compare_digest rejects non-ASCII str with TypeError
+    if not session_id or not hmac.compare_digest(signature.encode("utf-8"), _sign(session_id).encode("ascii")):
+        return None
+    return session_id
+
+
+def user_summary(user: dict) -> dict:
+    summary = {"id": str(user["_id"])}
+    summary.update({field: user.get(field) for field in SUMMARY_FIELDS})
+    return summary
+
+
+async def create_session(redis, user: dict) -> str:
+    summary = user_summary(user)
+    session_id = secrets.token_urlsafe(18)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.set(session_key(session_id), json.dumps(summary), ex=SESSION_TTL)
+        pipe.sadd(user_sessions_key(summary["id"]), session_id)
+        pipe.expire(user_sessions_key(summary["id"]), SESSION_TTL)
+        await pipe.execute()
+    return f"{session_id}.{_sign(session_id)}"
+
+
+async def get_session_user(redis, token: str) -> Optional[dict]:
+    """
+    The user summary for a session token, None if the token is forged,
+    expired or logged out.
+    """
+    session_id = _session_id(token)
+    if session_id is None:
+        return None
+    cached = await redis.get(session_key(session_id))
+    return json.loads(cached) if cached else None
+
+
+async def end_session(redis, token: str) -> bool:
+    session_id = _session_id(token)
+    if session_id is None:
+        return False
+    cached = await redis.get(session_key(session_id))
+    if not cached:
+        return False
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.delete(session_key(session_id))
+        pipe.srem(user_sessions_key(json.loads(cached)["id"]), session_id)
+        await pipe.execute()
+    return True
+
+
+async def update_user_sessions(redis, user_id: str, changes: dict):
+    # Rewrite the cached summary in every live session, keeping each one's expiry
+    session_ids = [s.decode() if isinstance(s, bytes) else s for s in await redis.smembers(user_sessions_key(user_id))]
+    if not session_ids:
+        return
+    cached = await redis.mget([session_key(session_id) for session_id in session_ids])
+    async with redis.pipeline(transaction=False) as pipe:
+        for session_id, value in zip(session_ids, cached):
+            if value is None:
+                pipe.srem(user_sessions_key(user_id), session_id)
+                continue
+            summary = {**json.loads(value), **{k: v for k, v in changes.items() if k in SUMMARY_FIELDS}}
+            pipe.set(session_key(session_id), json.dumps(summary), keepttl=True)
+        await pipe.execute()
+
+
+async def revoke_user_sessions(redis, user_id: str):
+    session_ids = [s.decode() if isinstance(s, bytes) else s for s in await redis.smembers(user_sessions_key(user_id))]
+    await redis.delete(user_sessions_key(user_id), *[session_key(session_id) for session_id in session_ids])